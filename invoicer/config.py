@@ -1,6 +1,7 @@
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Optional
 
 from dacite import from_dict
 
@@ -17,12 +18,50 @@ class InvoiceMailCfg:
     saluteName: str
 
 
+@dataclass
+class GmailCfg:
+    batchSize: int = 50
+    pageSize: int = 500
+    maxResults: Optional[int] = None
+    incrementalSync: bool = True
+    historyFile: str = ".gmail_history.json"
+    labelJournalFile: str = ".gmail_labels.sqlite3"
+    labelCacheFile: Optional[str] = ".gmail_label_ids.json"
+
+
+@dataclass
+class PipelineCfg:
+    renderWorkers: int = 2
+    sendWorkers: int = 4
+    labelWorkers: int = 1
+    queueSize: int = 16
+
+
+@dataclass
+class PdfCfg:
+    enabled: bool = False
+    workers: int = 1
+    soffice: str = "soffice"
+    timeout: int = 120
+
+
 @dataclass
 class Config:
     orderMail: OrderMailCfg
     invoiceMail: InvoiceMailCfg
     invoiceCountStart: int
     pollInterval: int
+    customerMailPollInterval: Optional[int] = None
+    maxRetryInterval: int = 600
+    invoiceNumbersFile: str = ".invoice_numbers.sqlite3"
+    processedMailsFile: str = ".processed_mails.sqlite3"
+    countryTranslationsFile: Optional[str] = ".country_translations.json"
+    onlineCountryTranslation: bool = False
+    genderNamesCacheFile: Optional[str] = ".gender_names.pickle"
+    invoiceArchiveDir: Optional[str] = None
+    gmail: GmailCfg = field(default_factory=GmailCfg)
+    pipeline: PipelineCfg = field(default_factory=PipelineCfg)
+    pdf: PdfCfg = field(default_factory=PdfCfg)
 
 
 def load_config(path: Path):
@@ -0,0 +1,101 @@
+import gettext
+import json
+import logging
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import pycountry
+from deep_translator import GoogleTranslator
+
+from invoicer.utils import atomic_write
+
+
+DEFAULT_LOCALES = ("de",)
+
+
+@lru_cache(maxsize=None)
+def country_codes(locales: Tuple[str, ...] = DEFAULT_LOCALES) -> Dict[str, str]:
+    """
+    Map the country names of each locale in `locales` to their ISO 3166 alpha-2 code.
+    Names of earlier locales take precedence. The English names of pycountry are used for locales
+    without a catalog. Built once per `locales` and shared by all callers.
+    """
+    codes = {}
+    for locale in reversed(locales):
+        translation = gettext.translation("iso3166", pycountry.LOCALES_DIR, languages=[locale], fallback=True)
+        codes.update((translation.gettext(country.name), country.alpha_2) for country in pycountry.countries)
+    return codes
+
+
+def country_code(name: str, locales: Tuple[str, ...] = DEFAULT_LOCALES) -> Optional[str]:
+    return country_codes(locales).get(name)
+
+
+@lru_cache(maxsize=None)
+def country_name(code: str, locale: str) -> str:
+    country = pycountry.countries.get(alpha_2=code)
+    if locale == "en":
+        return getattr(country, "common_name", country.name)
+    translation = gettext.translation("iso3166", pycountry.LOCALES_DIR, languages=[locale], fallback=True)
+    return translation.gettext(country.name)
+
+
+class CountryTranslator:
+    def __init__(
+        self, source: str = "de", target: str = "en", cache_file: Optional[Path] = None, online_fallback: bool = False
+    ) -> None:
+        """
+        Translate country names offline using the pycountry catalogs.
+        Names missing from the catalogs are looked up in the JSON `cache_file`, which can be edited by hand.
+        With `online_fallback`, names missing from both are translated with Google once and added to the cache.
+        Otherwise they are kept untranslated.
+        """
+        self.source = source
+        self.target = target
+        self.cache_file = cache_file
+        self.online_fallback = online_fallback
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def translate(self, name: str) -> str:
+        code = country_code(name, (self.source,))
+        if code is not None:
+            return country_name(code, self.target)
+
+        with self._lock:
+            if self._cache is None:
+                self._cache = self._load()
+            if name not in self._cache:
+                translated = self._translate_unknown(name)
+                if translated is None:
+                    return name
+                self._cache[name] = translated
+                self._save()
+            return self._cache[name]
+
+    def _translate_unknown(self, name: str) -> Optional[str]:
+        if not self.online_fallback:
+            logging.warning(f"Country {name} is unknown, it is not translated.")
+            return None
+        try:
+            return GoogleTranslator(source=self.source, target=self.target).translate(name)
+        except Exception:
+            logging.exception(f"Country {name} could not be translated online.")
+            return None
+
+    def _load(self) -> Dict[str, str]:
+        if self.cache_file is None:
+            return {}
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save(self):
+        if self.cache_file is None:
+            return
+        with atomic_write(self.cache_file) as f:
+            json.dump(self._cache, f, ensure_ascii=False, indent=4)
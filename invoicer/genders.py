@@ -0,0 +1,80 @@
+import logging
+import pickle
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional
+
+import gender_guesser.detector as gender
+from gender_guesser.detector import NoCountryError
+
+from invoicer.utils import atomic_write
+
+
+NAMES_FILE = Path(gender.__file__).parent / "data" / "nam_dict.txt"
+
+
+class GenderGuesser:
+    def __init__(self, cache_file: Optional[Path] = None, cache_size: int = 4096) -> None:
+        """
+        Guess genders of first names with a single gender_guesser Detector, created on first use.
+        Parsing the name dictionary is slow, so the parsed names are stored in `cache_file` and loaded
+        from there on later starts. Guesses are memoized per (name, country).
+        """
+        self.cache_file = cache_file
+        self._detector = None
+        self._lock = threading.Lock()
+        self.guess = lru_cache(maxsize=cache_size)(self._guess)
+
+    def _guess(self, name: str, country: Optional[str] = None) -> str:
+        detector = self._get_detector()
+        try:
+            return detector.get_gender(name=name, country=country)
+        except NoCountryError:
+            return detector.get_gender(name=name)
+
+    def _get_detector(self) -> gender.Detector:
+        with self._lock:
+            if self._detector is None:
+                self._detector = self._load_detector()
+            return self._detector
+
+    def _load_detector(self) -> gender.Detector:
+        source = _source_version()
+        if self.cache_file is not None:
+            try:
+                with open(self.cache_file, "rb") as f:
+                    cached = pickle.load(f)
+                if cached["source"] == source:
+                    # Skip Detector.__init__, which parses the name dictionary.
+                    detector = gender.Detector.__new__(gender.Detector)
+                    detector.case_sensitive = True
+                    detector.names = cached["names"]
+                    return detector
+            except FileNotFoundError:
+                pass
+            except Exception:
+                logging.warning(f"Gender names cache {self.cache_file} is invalid, it is rebuilt.")
+
+        detector = gender.Detector()
+        if self.cache_file is not None:
+            with atomic_write(self.cache_file, mode="wb") as f:
+                pickle.dump({"source": source, "names": detector.names}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return detector
+
+
+def _source_version():
+    stat = NAMES_FILE.stat()
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+_shared: Dict[Optional[Path], GenderGuesser] = {}
+_shared_lock = threading.Lock()
+
+
+def shared_gender_guesser(cache_file: Optional[Path] = None) -> GenderGuesser:
+    """Return the guesser of this process for `cache_file`, so the name dictionary is loaded once."""
+    with _shared_lock:
+        if cache_file not in _shared:
+            _shared[cache_file] = GenderGuesser(cache_file=cache_file)
+        return _shared[cache_file]
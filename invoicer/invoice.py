@@ -1,26 +1,111 @@
+import copy
+import io
 import logging
 import re
-from collections import namedtuple
+import threading
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
-import gender_guesser.detector as gender
-import pycountry
-from deep_translator import GoogleTranslator
 from docx import Document
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import qn
 from docx.shared import Pt
-from gender_guesser.detector import NoCountryError
+from docx.text.paragraph import Paragraph
 
 from invoicer.config import Config
+from invoicer.countries import CountryTranslator
+from invoicer.genders import GenderGuesser, shared_gender_guesser
+from invoicer.ledger import TaxLedger, TaxTotals
+from invoicer.numbering import InvoiceNumberAllocator
 from invoicer.order import Address, Customer, Invoice, Item, Order
 from invoicer.order_mail_parsers import find_country_index
-from invoicer.utils import eur, get_short_date, get_year, prepend_zeros
+from invoicer.pdf import PdfConversionError, PdfConverter
+from invoicer.utils import eur, from_cents, get_short_date, get_year
 
 
 Font = namedtuple("Font", ("name", "size"))
 TableIndices = namedtuple("TableIndices", ("items", "sum", "passport"))
-Replacement = namedtuple("Replacement", ("old", "new", "font"))
+Replacement = namedtuple("Replacement", ("old", "new"))
+# Location of a placeholder in the paragraphs of a template, as listed by `_template_paragraphs`:
+# it starts at offset `start` of run `first_run` and ends before offset `end` of run `last_run`.
+Span = namedtuple("Span", ("paragraph", "first_run", "start", "last_run", "end"))
+# Placeholders of a template that had no value, and those whose value was None.
+PlaceholderReport = namedtuple("PlaceholderReport", ("unknown", "unfilled"))
+
+PLACEHOLDER = re.compile(r"{{[^{}]+}}")
+TABLE_FONT = Font("Calibri", 10)
+# Alignment of the columns of the item table: position, count, unit, description and three prices.
+ITEM_COLUMN_ALIGNMENTS = (
+    WD_ALIGN_PARAGRAPH.CENTER,
+    WD_ALIGN_PARAGRAPH.CENTER,
+    WD_ALIGN_PARAGRAPH.CENTER,
+    WD_ALIGN_PARAGRAPH.LEFT,
+    WD_ALIGN_PARAGRAPH.RIGHT,
+    WD_ALIGN_PARAGRAPH.RIGHT,
+    WD_ALIGN_PARAGRAPH.RIGHT,
+)
+
+
+class InvoiceTemplate:
+    def __init__(self, path: Path) -> None:
+        """
+        Parse the template once and index where its placeholders are, in the body, tables, headers
+        and footers, so that each invoice starts from a cheap copy of the parsed document instead of
+        re-reading the file and searching it again.
+        """
+        self.path = path
+        self._document = Document(path)
+        self._lock = threading.Lock()
+        self.spans = _index_placeholders(_template_paragraphs(self.new_document()))
+
+    def new_document(self) -> Document:
+        # The template is only ever copied. python-docx caches the body of a document on first access, and
+        # copies of a document with a cached body would edit a detached copy of it instead of the saved one.
+        with self._lock:
+            return copy.deepcopy(self._document)
+
+    def fill(self, document: Document, values: Dict[str, Optional[str]]) -> PlaceholderReport:
+        """
+        Replace the placeholders of `document`, a copy from `new_document`, by `values` keyed by placeholder,
+        e.g. "{{date}}". Runs are edited in place, so their formatting is kept.
+        Call it before adding paragraphs or table rows, the indexed locations are only valid until then.
+        Placeholders without a value or with a None value are left in the document and reported.
+        """
+        edits = []
+        unknown = []
+        unfilled = []
+        for placeholder, spans in self.spans.items():
+            if placeholder not in values:
+                unknown.append(placeholder)
+            elif values[placeholder] is None:
+                unfilled.append(placeholder)
+            else:
+                edits.extend((span, values[placeholder]) for span in spans)
+        for placeholder in values.keys() - self.spans.keys():
+            logging.warning(f"Placeholder {placeholder} is not found in template {self.path}.")
+
+        # Editing back to front keeps the offsets of the remaining spans valid.
+        paragraphs = _template_paragraphs(document)
+        for span, new in sorted(edits, reverse=True):
+            _replace_span(runs=paragraphs[span.paragraph].runs, span=span, new=new)
+        return PlaceholderReport(unknown=unknown, unfilled=unfilled)
+
+
+@dataclass
+class InvoiceResult:
+    order: Order
+    invoice: Optional[Invoice] = None
+    errors: List[str] = field(default_factory=list)
+    exception: Optional[Exception] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.exception is None
 
 
 class InvoiceGenerator:
@@ -29,27 +114,26 @@ class InvoiceGenerator:
         self.table_indices = TableIndices(items=0, sum=1, passport=2)
         self.config = cfg
         self.template_path = template_path
-
-    def _create_invoice_nr(self, year_invoice: int):
-        try:
-            with open(".last_invoice_count", "r", encoding="utf-8") as f:
-                last_invoice_count = int(f.read())
-        except FileNotFoundError:
-            last_invoice_count = self.config.invoiceCountStart
-
-        invoice_count = str(last_invoice_count + 1)
-        invoice_count = prepend_zeros(value=invoice_count, num_min_digits=3) 
-
-        invoice_nr = str(year_invoice) + invoice_count
-
-        with open(".last_invoice_count", "w", encoding="utf-8") as f:
-            f.write(str(invoice_count))
-
-        return invoice_nr
-
+        self.template = InvoiceTemplate(template_path)
+        self.invoice_numbers = InvoiceNumberAllocator(
+            path=Path(cfg.invoiceNumbersFile), start_count=cfg.invoiceCountStart
+        )
+        translations_file = cfg.countryTranslationsFile
+        self.country_translator = CountryTranslator(
+            cache_file=Path(translations_file) if translations_file else None,
+            online_fallback=cfg.onlineCountryTranslation,
+        )
+        names_file = cfg.genderNamesCacheFile
+        self.gender_guesser = shared_gender_guesser(cache_file=Path(names_file) if names_file else None)
+        self.archive_dir = Path(cfg.invoiceArchiveDir) if cfg.invoiceArchiveDir else None
+        if self.archive_dir is not None:
+            self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.pdf_converter = None
+        if cfg.pdf.enabled:
+            self.pdf_converter = PdfConverter(workers=cfg.pdf.workers, soffice=cfg.pdf.soffice, timeout=cfg.pdf.timeout)
 
     def _check_errors(self, order: Order, init_default=True, dump_errors: Optional[bool] = None, dump_errors_path: Optional[Path] = None):
-        order = Order(**order.__dict__)
+        order = replace(order)
 
         to_be_checked_attrs = (
             ("date", ""),
@@ -76,19 +160,27 @@ class InvoiceGenerator:
 
         return (order, errors)
 
-    def generate(self, order: Order):
+    def reserve_invoice_number(self, order: Order):
         """
-        Validate order and log errors. 
-        Replace missing data accordingly.
-        Generate invoice from order.
+        Date and number the invoice of order, unless already done.
+        Numbers are given in call order, so call it in the order invoices should be numbered.
+        An order that was numbered before gets its number again.
         """
         if order.invoice.date is None:
             order.invoice.date = get_short_date(order.date)
         if order.invoice.number is None:
-            order.invoice.number = self._create_invoice_nr(
-                year_invoice=get_year(order.invoice.date)
+            order.invoice.number = self.invoice_numbers.reserve(
+                year=get_year(order.invoice.date), order_key=_order_key(order)
             )
 
+    def generate(self, order: Order) -> Tuple[Invoice, List[str]]:
+        """
+        Validate order and log errors. 
+        Replace missing data accordingly.
+        Generate invoice from order into `order.invoice.docx`, and also into the archive directory if configured.
+        """
+        self.reserve_invoice_number(order)
+
         order, errors = self._check_errors(
             order=order,
             init_default=True,
@@ -96,39 +188,114 @@ class InvoiceGenerator:
             dump_errors_path=Path(f"Invoice-{order.invoice.number}-Errors.txt")
         )
         
-        invoice = Document(self.template_path)
+        invoice = self.template.new_document()
 
-        self._replace_paragraphs(order=order, invoice=invoice)
+        report = self._replace_placeholders(order=order, invoice=invoice)
+        errors = errors + report.unknown + report.unfilled
         self._replace_tables(order=order, invoice=invoice)
 
-        docx_path = Path(f"docs/Invoice-{order.invoice.number}.docx")
-        invoice.save(docx_path)
-        # pdf_path = docx_path.with_suffix(".pdf")
-        # subprocess.run(
-        #     [
-        #         "libreoffice",
-        #         "--convert-to",
-        #         "pdf",
-        #         str(docx_path),
-        #         "--outdir",
-        #         str(pdf_path.parent),
-        #     ]
-        # )
-        return (docx_path, errors)
-
-    def _replace_paragraphs(self, order: Order, invoice=Document):
-        full_address = _get_full_address(order)
+        buffer = io.BytesIO()
+        invoice.save(buffer)
+        order.invoice.docx = buffer.getvalue()
+        if self.archive_dir is not None:
+            self.archive_path(order.invoice).write_bytes(order.invoice.docx)
+        return (order.invoice, errors)
+
+    def add_pdfs(self, invoices: Sequence[Invoice]) -> List[bool]:
+        """
+        Convert rendered invoices to PDF in one batch, into `invoice.pdf` and into the archive directory if configured.
+        Returns whether each invoice was converted and archived. Invoices that were not converted are left without PDF.
+        """
+        try:
+            pdfs = self.pdf_converter.convert_many([invoice.docx for invoice in invoices])
+        except PdfConversionError:
+            logging.exception(f"{len(invoices)} invoices could not be converted to PDF.")
+            return [False] * len(invoices)
+
+        converted = []
+        for invoice, pdf in zip(invoices, pdfs):
+            if pdf is None:
+                converted.append(False)
+                continue
+            invoice.pdf = pdf
+            try:
+                if self.archive_dir is not None:
+                    self.archive_path(invoice).with_suffix(".pdf").write_bytes(pdf)
+            except OSError:
+                logging.exception(f"PDF of invoice #{invoice.number} could not be archived.")
+                converted.append(False)
+                continue
+            converted.append(True)
+        return converted
+
+    def archive_path(self, invoice: Invoice) -> Path:
+        return self.archive_dir / f"Invoice-{invoice.number}.docx"
+
+    def generate_many(self, orders: Iterable[Order], workers: Optional[int] = None) -> List[InvoiceResult]:
+        """
+        Generate invoices of orders across `workers` processes, one per CPU by default.
+        Invoice numbers are reserved up front in the order of `orders`, so the output does not
+        depend on which process finishes first. Results follow the order of `orders`.
+        If PDF output is enabled, all rendered invoices are converted together at the end.
+        """
+        results = []
+        unnumbered = []
+        requests = []
+        for order in orders:
+            result = InvoiceResult(order=order)
+            results.append(result)
+            try:
+                if order.invoice.date is None:
+                    order.invoice.date = get_short_date(order.date)
+                if order.invoice.number is None:
+                    requests.append((get_year(order.invoice.date), _order_key(order)))
+                    unnumbered.append(result)
+            except Exception as e:
+                logging.exception(f"Invoice of order {order.number} could not be dated.")
+                result.exception = e
+        pending = [result for result in results if result.succeeded]
+
+        # All numbers are reserved in a single transaction, only for orders without one.
+        numbers = self.invoice_numbers.reserve_many(requests)
+        for result, number in zip(unnumbered, numbers):
+            result.order.invoice.number = number
+
+        if workers == 1:
+            for result in pending:
+                _fill_result(result, render=partial(self.generate, order=result.order))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(self.config, self.template_path)
+            ) as pool:
+                futures = [pool.submit(_generate_in_worker, result.order) for result in pending]
+                for result, future in zip(pending, futures):
+                    _fill_result(result, render=future.result)
+
+        rendered = [result for result in pending if result.succeeded]
+        if self.pdf_converter is not None and len(rendered) > 0:
+            converted = self.add_pdfs([result.invoice for result in rendered])
+            for result, succeeded in zip(rendered, converted):
+                if not succeeded:
+                    result.errors.append("pdf")
+        return results
+
+    def _replace_placeholders(self, order: Order, invoice=Document) -> PlaceholderReport:
+        full_address = _get_full_address(order, translate_country=self.country_translator.translate)
+        # Items are taxed at 7%, only the shipping at the end of the item table at 19%.
+        item_count = len(order.items)
+        positions_7 = "1" if item_count == 1 else f"1-{item_count}"
 
         replacements = (
-            Replacement(r"{{address}}", full_address, Font("Courier New", 10)),
-            Replacement(r"{{date}}", order.invoice.date, Font("Arial", 11)),
-            Replacement(r"{{invoice_nr}}", order.invoice.number, Font("Arial", 16)),
-            Replacement(r"{{salutation}}", _guess_salutation(order), Font("Arial", 32)),
-            Replacement(r"{{payment_method}}", order.payment_method, Font("Arial", 8)),
+            Replacement(r"{{address}}", full_address),
+            Replacement(r"{{date}}", order.invoice.date),
+            Replacement(r"{{invoice_nr}}", order.invoice.number),
+            Replacement(r"{{salutation}}", _guess_salutation(order, full_address=full_address, gender_guesser=self.gender_guesser)),
+            Replacement(r"{{payment_method}}", order.payment_method),
+            Replacement(r"{{7_s_e}}", positions_7),
+            Replacement(r"{{19_s_e}}", str(item_count + 1)),
         )
 
-        for replacement in replacements:
-            self._replace(**replacement._asdict(), invoice=invoice)
+        return self._replace(replacements=replacements, invoice=invoice)
 
     def _replace_tables(self, order: Order, invoice: Document):
         shipping = Item(
@@ -141,7 +308,7 @@ class InvoiceGenerator:
         items = order.items[:] + [shipping]
 
         item_table = invoice.tables[self.table_indices.items]
-        _replace_item_table(t=item_table, items=items)
+        _replace_item_table(t=item_table, items=items, font=TABLE_FONT)
 
         sum_table = invoice.tables[self.table_indices.sum]
         _replace_sum_table(t=sum_table, items=items)
@@ -149,47 +316,60 @@ class InvoiceGenerator:
         passport_table = invoice.tables[self.table_indices.passport]
         _replace_passport_table(t=passport_table, order=order)
 
-        tables = (item_table, sum_table, passport_table)
+        for table in (sum_table, passport_table):
+            _change_font(table, TABLE_FONT)
 
-        for table in tables:
-            _change_font(table, Font("Calibri", 10))
+    def _replace(self, replacements: Tuple[Replacement, ...], invoice: Document) -> PlaceholderReport:
+        report = self.template.fill(invoice, {replacement.old: replacement.new for replacement in replacements})
+        for placeholder in report.unknown:
+            logging.warning(f"Placeholder {placeholder} of template {self.template.path} has no value.")
+        for placeholder in report.unfilled:
+            logging.warning(f"Placeholder {placeholder} is left unfilled, its value is missing.")
+        return report
 
-    def _replace(self, invoice: Document, old: str, new: str, font: Optional[Font] = None):
-        # if font is None:
-        #     font = self.default_font
-        index = self._get_index(token=old, invoice=invoice)
-        p = invoice.paragraphs[index]
-        paragraph_replace_text(paragraph=p, regex=re.compile(old), replace_str=new)
-        # # TODO: This changes font for the whole paragraph, convert to run.
 
-        # if font:
-        #     _change_paragraph_font(p=p, new=font)
-        # replaced = invoice.paragraphs[index].text.replace(old, new)
-        # invoice.paragraphs[index].text = replaced
+def _order_key(order: Order) -> Optional[str]:
+    if order.source_mail is not None and order.source_mail.ident is not None:
+        return f"mail:{order.source_mail.ident}"
+    if order.number is not None:
+        return f"order:{order.number}"
+    return None
 
-    def _get_index(self, token: str, invoice: Document):
-        paragraphs = [p.text for p in invoice.paragraphs]
-        for i, p in enumerate(paragraphs):
-            if token in p:
-                return i
 
+# Generator of the current worker process of InvoiceGenerator.generate_many.
+_worker_generator: Optional[InvoiceGenerator] = None
 
-def _guess_salutation(order: Order):
-    address = _get_full_address(order)
-    address_parts = address.split("\n")
+
+def _init_worker(cfg: Config, template_path: Path):
+    global _worker_generator
+    _worker_generator = InvoiceGenerator(cfg=cfg, template_path=template_path)
+
+
+def _generate_in_worker(order: Order):
+    return _worker_generator.generate(order=order)
+
+
+def _fill_result(result: InvoiceResult, render: Callable[[], Tuple[Invoice, List[str]]]):
+    try:
+        # Invoices rendered in a worker process come back as copies.
+        result.invoice, result.errors = render()
+        result.order.invoice = result.invoice
+    except Exception as e:
+        logging.error(f"Invoice #{result.order.invoice.number} could not be generated: {e!r}")
+        result.exception = e
+
+
+def _guess_salutation(order: Order, full_address: str, gender_guesser: GenderGuesser):
+    address_parts = full_address.split("\n")
     full_name = address_parts[0]
 
     country = address_parts[-1]
-    d = gender.Detector()
     name_parts = full_name.split(" ")
     name_pick = name_parts[0]
     if name_parts[0] in ["Dr.", "Dr", "Prof.", "Prof"]:
         name_pick = name_parts[1]
 
-    try:
-        result = d.get_gender(name=name_pick, country=country.lower())
-    except NoCountryError:
-        result = d.get_gender(name=name_pick)
+    result = gender_guesser.guess(name_pick, country.lower())
 
     if order.customer.surname in full_name:
         saluatation_name = order.customer.surname
@@ -205,58 +385,58 @@ def _guess_salutation(order: Order):
     return f"Sehr geehrte(r) Frau/Herr {saluatation_name}"
 
 
-def _write_item_to_row(index, item, row):
-    row.cells[0].text = str(index)
-    row.cells[1].text = str(item.count)
-    row.cells[2].text = item.unit
-    row.cells[3].text = item.description
-    row.cells[4].text = eur(item.unit_price_net)
-    row.cells[5].text = eur(item.unit_price_gross)
-    row.cells[6].text = eur(item.total_price_gross)
+def _item_row_texts(index, item):
+    return (
+        str(index),
+        str(item.count),
+        item.unit,
+        item.description,
+        eur(item.unit_price_net),
+        eur(item.unit_price_gross),
+        eur(item.total_price_gross),
+    )
 
 
-def _replace_item_table(t, items: List[Item]):
-    # t.style.font.name = "Calibri"
-    # t.style.font.size = Pt(10)
+def _replace_item_table(t, items: List[Item], font: Font):
+    """
+    Style the rows of the template and append a row per item.
+    Item rows are copies of a single row that is styled once with python-docx, so only their texts are set per item.
+    """
+    for column, alignment in zip(t.columns, ITEM_COLUMN_ALIGNMENTS):
+        align_column(column, alignment)
+    _change_font(t, font)
+
+    prototype = t.add_row()
+    for cell, alignment in zip(prototype.cells, ITEM_COLUMN_ALIGNMENTS):
+        # A non-empty text creates the run that holds the font.
+        cell.text = "-"
+        cell.paragraphs[0].alignment = alignment
+    _change_font_of_cells(prototype.cells, font)
+    tbl = t._tbl
+    tbl.remove(prototype._tr)
+
     for i, item in enumerate(items):
-        row = t.add_row()
-        _write_item_to_row(index=i + 1, item=item, row=row)
-
-    align_column(t.columns[0], WD_ALIGN_PARAGRAPH.CENTER)
-    align_column(t.columns[1], WD_ALIGN_PARAGRAPH.CENTER)
-    align_column(t.columns[2], WD_ALIGN_PARAGRAPH.CENTER)
-    align_column(t.columns[3], WD_ALIGN_PARAGRAPH.LEFT)
-    align_column(t.columns[4], WD_ALIGN_PARAGRAPH.RIGHT)
-    align_column(t.columns[5], WD_ALIGN_PARAGRAPH.RIGHT)
-    align_column(t.columns[6], WD_ALIGN_PARAGRAPH.RIGHT)
+        tr = copy.deepcopy(prototype._tr)
+        for r, text in zip(tr.iter(qn("w:r")), _item_row_texts(index=i + 1, item=item)):
+            r.text = text
+        tbl.append(tr)
 
 
 def _replace_sum_table(t, items: List[Item]):
-    def get_sum(tax_rate: float, attr: str):
-        return sum([getattr(item, attr) for item in items if item.tax_rate == tax_rate])
-
     # t.style.font.name = "Calibri"
     # t.style.font.size = Pt(10)
 
-    sum_net_price_7 = get_sum(tax_rate=0.07, attr="total_price_net")
-    sum_net_price_19 = get_sum(tax_rate=0.19, attr="total_price_net")
-    tax_7 = get_sum(tax_rate=0.07, attr="tax")
-    tax_19 = get_sum(tax_rate=0.19, attr="tax")
+    totals = TaxLedger.from_items(items).totals()
+    empty = TaxTotals(0, 0, 0)
+    totals_7 = totals.get(0.07, empty)
+    totals_19 = totals.get(0.19, empty)
 
-    values = (sum_net_price_7, sum_net_price_19, tax_7, tax_19)
+    values = (totals_7.net, totals_19.net, totals_7.tax, totals_19.tax)
     for i, value in enumerate(values):
-        t.cell(i, 6).text = eur(value)
-    t.cell(len(values), 6).text = eur(sum(values))
+        t.cell(i, 6).text = eur(from_cents(value))
+    t.cell(len(values), 6).text = eur(from_cents(sum(values)))
 
     align_column(t.columns[6], WD_ALIGN_PARAGRAPH.RIGHT)
-
-    if len(items) - 1 == 1:
-        s_e_7 = "1"
-    else:
-        s_e_7 = f"{1}-{len(items) - 1}"
-
-    t.cell(2, 3).text = t.cell(2, 3).text.replace(r"{{7_s_e}}", s_e_7)
-    t.cell(3, 3).text = t.cell(3, 3).text.replace(r"{{19_s_e}}", f"{len(items)}")
     align_column(t.columns[3], WD_ALIGN_PARAGRAPH.RIGHT)
 
 
@@ -270,7 +450,7 @@ def _replace_passport_table(t, order: Order):
     t.cell(10, 4).text = "".join(reversed(date.split("."))) + "-" + invoice_nr[4:]
 
 
-def _get_full_address(order: Order):
+def _get_full_address(order: Order, translate_country: Callable[[str], str]):
     address = order.invoice.address
     full_name = address.full_name
     address = address.address
@@ -282,85 +462,78 @@ def _get_full_address(order: Order):
     if country == "Deutschland":
         address_parts = address_parts[:2]
     else:
-        country_en = GoogleTranslator(source="de", target="en").translate(country)
-        address_parts[country_index] = country_en
+        address_parts[country_index] = translate_country(country)
 
     address = "\n".join(address_parts)
     return "\n".join([full_name, address])
 
 
-def _get_country_en(country_de: str):
-    for country in pycountry.countries:
-        if _(country.name) == country_de:
-            return country.name
-
-    # if country == "Deutschland":
-    #     residential_address_end_index = 2
-    # else:
-    #     invoice_address[country_index] = GoogleTranslator(source="de", target="en").translate(country)
-
-
-def paragraph_replace_text(paragraph, regex, replace_str):
-    """Return `paragraph` after replacing all matches for `regex` with `replace_str`.
-
-    `regex` is a compiled regular expression prepared with `re.compile(pattern)`
-    according to the Python library documentation for the `re` module.
+def _template_paragraphs(document: Document) -> List[Paragraph]:
+    """
+    List all paragraphs of `document` in a fixed order: those of the body, including tables, followed by
+    those of its headers and footers. Copies of a document list their paragraphs in the same order.
     """
-    # --- a paragraph may contain more than one match, loop until all are replaced ---
-    while True:
-        text = paragraph.text
-        match = regex.search(text)
-        if not match:
-            break
-
-        # --- when there's a match, we need to modify run.text for each run that
-        # --- contains any part of the match-string.
-        runs = iter(paragraph.runs)
-        start, end = match.start(), match.end()
-
-        # --- Skip over any leading runs that do not contain the match ---
-        for run in runs:
-            run_len = len(run.text)
-            if start < run_len:
-                break
-            start, end = start - run_len, end - run_len
-
-        # --- Match starts somewhere in the current run. Replace match-str prefix
-        # --- occurring in this run with entire replacement str.
-        run_text = run.text
-        run_len = len(run_text)
-        run.text = "%s%s%s" % (run_text[:start], replace_str, run_text[end:])
-        end -= run_len  # --- note this is run-len before replacement ---
-
-        # --- Remove any suffix of match word that occurs in following runs. Note that
-        # --- such a suffix will always begin at the first character of the run. Also
-        # --- note a suffix can span one or more entire following runs.
-        for run in runs:  # --- next and remaining runs, uses same iterator ---
-            if end <= 0:
-                break
-            run_text = run.text
-            run_len = len(run_text)
-            run.text = run_text[end:]
-            end -= run_len
-
-    # --- optionally get rid of any "spanned" runs that are now empty. This
-    # --- could potentially delete things like inline pictures, so use your judgement.
-    # for run in paragraph.runs:
-    #     if run.text == "":
-    #         r = run._r
-    #         r.getparent().remove(r)
-
-    return paragraph
+    # Parts are walked as XML, since python-docx adds a header to a section when asked for one it links
+    # to the previous section.
+    parts = [document.part]
+    parts.extend(rel.target_part for rel in document.part.rels.values() if rel.reltype in (RT.HEADER, RT.FOOTER))
+    return [Paragraph(p, part) for part in parts for p in part.element.iter(qn("w:p"))]
+
+
+def _index_placeholders(paragraphs) -> Dict[str, List[Span]]:
+    spans = defaultdict(list)
+    for i, paragraph in enumerate(paragraphs):
+        run_texts = [run.text for run in paragraph.runs]
+        text = "".join(run_texts)
+        if "{{" not in text:
+            continue
+
+        # Start offset of each run in the paragraph text.
+        run_starts = []
+        offset = 0
+        for run_text in run_texts:
+            run_starts.append(offset)
+            offset += len(run_text)
+
+        def locate(offset: int, is_end: bool):
+            # An end offset belongs to the run it closes, a start offset to the run it opens.
+            for run_index in reversed(range(len(run_texts))):
+                if run_starts[run_index] < offset or (not is_end and run_starts[run_index] == offset):
+                    return run_index, offset - run_starts[run_index]
+
+        for match in PLACEHOLDER.finditer(text):
+            first_run, start = locate(match.start(), is_end=False)
+            last_run, end = locate(match.end(), is_end=True)
+            spans[match.group()].append(Span(i, first_run, start, last_run, end))
+    return dict(spans)
+
+
+def _replace_span(runs, span: Span, new: str):
+    if span.first_run == span.last_run:
+        run = runs[span.first_run]
+        run.text = run.text[: span.start] + new + run.text[span.end :]
+        return
+
+    first_run = runs[span.first_run]
+    first_run.text = first_run.text[: span.start] + new
+    for run in runs[span.first_run + 1 : span.last_run]:
+        run.text = ""
+    last_run = runs[span.last_run]
+    last_run.text = last_run.text[span.end :]
+
 
 
 def _change_font(table, font):
     for row in table.rows:
-        for cell in row.cells:
-            paragraphs = cell.paragraphs
-            for paragraph in paragraphs:
-                for run in paragraph.runs:
-                    run.font.name = font.name
-                    run.font.size = Pt(font.size)
+        _change_font_of_cells(row.cells, font)
+
+
+def _change_font_of_cells(cells, font):
+    for cell in cells:
+        for paragraph in cell.paragraphs:
+            for run in paragraph.runs:
+                run.font.name = font.name
+                run.font.size = Pt(font.size)
 
 
 def align_column(column, alignment):
@@ -0,0 +1,110 @@
+import json
+import logging
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set
+
+from invoicer.sqlite import SqliteStore
+from invoicer.utils import atomic_write
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_labels (
+    mail_id TEXT NOT NULL,
+    label TEXT NOT NULL,
+    added_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (mail_id, label)
+);
+"""
+
+
+class LabelJournal(SqliteStore):
+    def __init__(self, path: Path) -> None:
+        """
+        Record labels (by name) that are still to be added to mails in an SQLite database at `path`.
+        A label is recorded as soon as the mail it marks as done has been handled, and removed once Gmail
+        applied it. Mails with recorded labels count as done even if the process stops before the labels
+        reach Gmail, so they are never handled twice.
+        """
+        super().__init__(path, SCHEMA)
+
+    def add(self, mail_id: str, label: str) -> None:
+        with self._transaction() as db:
+            db.execute("INSERT OR IGNORE INTO pending_labels (mail_id, label) VALUES (?, ?)", (mail_id, label))
+
+    def pending(self) -> Dict[str, List[str]]:
+        """Return the ids of mails waiting for each label name, oldest first."""
+        with self._transaction() as db:
+            rows = db.execute("SELECT label, mail_id FROM pending_labels ORDER BY added_at, rowid").fetchall()
+        mail_ids = defaultdict(list)
+        for label, mail_id in rows:
+            mail_ids[label].append(mail_id)
+        return dict(mail_ids)
+
+    def pending_mail_ids(self) -> Set[str]:
+        with self._transaction() as db:
+            return {row[0] for row in db.execute("SELECT mail_id FROM pending_labels")}
+
+    def remove(self, label: str, mail_ids: Sequence[str]) -> None:
+        with self._transaction() as db:
+            db.executemany(
+                "DELETE FROM pending_labels WHERE mail_id = ? AND label = ?",
+                ((mail_id, label) for mail_id in mail_ids),
+            )
+
+
+class LabelIds:
+    def __init__(self, mailing, cache_file: Optional[Path]) -> None:
+        """
+        Map label names to the ids of the `mailing` account, creating labels that do not exist yet.
+        Ids are cached in `cache_file` across restarts, so a warm start makes no request at all. Otherwise
+        labels are listed once, on the first name missing from the cache, and only missing labels are created.
+        Without a `cache_file`, ids are only kept in memory. Ids can be looked up from several threads.
+        """
+        self._mailing = mailing
+        self.cache_file = cache_file
+        self._ids: Optional[Dict[str, str]] = None
+        self._listed = False
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> str:
+        with self._lock:
+            if self._ids is None:
+                self._ids = self._load()
+            if name not in self._ids:
+                if not self._listed:
+                    self._ids.update({label["name"]: label["id"] for label in self._mailing.get_labels()})
+                    self._listed = True
+                if name not in self._ids:
+                    self._ids[name] = self._mailing.insert_label(name)
+                self._save()
+            return self._ids[name]
+
+    def invalidate(self) -> None:
+        """Forget all ids, e.g. after Gmail rejected one of them because the label was deleted."""
+        with self._lock:
+            self._ids = {}
+            self._listed = False
+            self._save()
+
+    def _load(self) -> Dict[str, str]:
+        if self.cache_file is None:
+            return {}
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                ids = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            ids = None
+        if not isinstance(ids, dict) or not all(isinstance(v, str) and v for v in ids.values()):
+            logging.warning(f"Ignoring invalid label cache {self.cache_file}.")
+            return {}
+        return ids
+
+    def _save(self):
+        if self.cache_file is None:
+            return
+        with atomic_write(self.cache_file) as f:
+            json.dump(self._ids, f)
@@ -0,0 +1,54 @@
+from array import array
+from collections import namedtuple
+from typing import Dict, Iterable
+
+from invoicer.order import Item
+
+
+# Amounts in integer cents.
+TaxTotals = namedtuple("TaxTotals", ("net", "tax", "gross"))
+
+
+class TaxLedger:
+    def __init__(self) -> None:
+        """
+        Line items as integer cents in flat arrays, one entry per line, so that the lines of a single
+        invoice and those of a whole year of invoices are totalled the same way, exactly and in one pass.
+        Net amounts are rounded per line when a line is added.
+        """
+        self._rates = array("d")
+        self._net = array("q")
+        self._gross = array("q")
+
+    @classmethod
+    def from_items(cls, items: Iterable[Item]) -> "TaxLedger":
+        ledger = cls()
+        ledger.add_items(items)
+        return ledger
+
+    def add_items(self, items: Iterable[Item]):
+        for item in items:
+            self._rates.append(item.tax_rate)
+            self._net.append(item.net_cents)
+            self._gross.append(item.gross_cents)
+
+    def __len__(self) -> int:
+        return len(self._gross)
+
+    def totals(self) -> Dict[float, TaxTotals]:
+        """Return net, tax and gross totals per tax rate."""
+        net = {}
+        gross = {}
+        for rate, line_net, line_gross in zip(self._rates, self._net, self._gross):
+            if rate in net:
+                net[rate] += line_net
+                gross[rate] += line_gross
+            else:
+                net[rate] = line_net
+                gross[rate] = line_gross
+        return {rate: TaxTotals(net[rate], gross[rate] - net[rate], gross[rate]) for rate in sorted(gross)}
+
+    def total(self) -> TaxTotals:
+        net = sum(self._net)
+        gross = sum(self._gross)
+        return TaxTotals(net, gross - net, gross)
@@ -3,37 +3,134 @@ from dataclasses import dataclass, field
 import email
 from email.message import EmailMessage
 from email.utils import parseaddr
+import os
 from pathlib import Path
-from typing import Optional, Tuple, List
+import tempfile
+import threading
+from typing import Iterator, Optional, Tuple, List, Union
 import logging
 
+
+class Base64Text:
+    def __init__(self, data: str, charset: str = "utf-8") -> None:
+        """Base64url encoded body of a Gmail part, decoded when the text is first read."""
+        self.data = data
+        self.charset = charset
+
+    def decode(self) -> str:
+        data = base64.urlsafe_b64decode(self.data)
+        try:
+            return data.decode(self.charset, errors="replace")
+        except LookupError:
+            logging.warning(f"Unknown charset {self.charset}, decoding as utf-8.")
+            return data.decode("utf-8", errors="replace")
+
+
+class TextSpool:
+    def __init__(self) -> None:
+        """
+        Append-only temporary file keeping texts out of memory until they are read back.
+        The file is deleted once the spool and all texts spilled to it are garbage collected.
+        """
+        self._file = tempfile.TemporaryFile()
+        self._lock = threading.Lock()
+        self._size = 0
+
+    def spill(self, text: str) -> "SpilledText":
+        data = text.encode("utf-8")
+        with self._lock:
+            offset = self._size
+            os.pwrite(self._file.fileno(), data, offset)
+            self._size += len(data)
+        return SpilledText(spool=self, offset=offset, length=len(data))
+
+    def read(self, offset: int, length: int) -> str:
+        return os.pread(self._file.fileno(), length, offset).decode("utf-8")
+
+
+class SpilledText:
+    def __init__(self, spool: TextSpool, offset: int, length: int) -> None:
+        """Mail text written to a `TextSpool`, read back on every access instead of kept in memory."""
+        self.spool = spool
+        self.offset = offset
+        self.length = length
+
+    def decode(self) -> str:
+        return self.spool.read(self.offset, self.length)
+
+    def __reduce__(self):
+        # Mails sent to other processes carry their text, the spool file is local to this one.
+        return str, (self.decode(),)
+
+
+class _LazyText:
+    """
+    Mail text field which can be set to a `Base64Text`, decoded and kept on first access, or to a
+    `SpilledText`, read back from its spool on each access.
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = "_" + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return None
+        value = getattr(obj, self.name)
+        if isinstance(value, Base64Text):
+            value = value.decode()
+            setattr(obj, self.name, value)
+        elif isinstance(value, SpilledText):
+            value = value.decode()
+        return value
+
+    def __set__(self, obj, value: Union[str, Base64Text, SpilledText, None]):
+        setattr(obj, self.name, value)
+
+
 @dataclass
 class Mail:
     sender: str
     to: str
     subject: str
     date: Optional[str] = None
-    html: Optional[str] = None
-    plain_text: Optional[str] = None
+    html: Optional[str] = _LazyText()
+    plain_text: Optional[str] = _LazyText()
     ident: Optional[str] = None
-    attachments: List[Path] = field(default_factory=list)
+    # Files on disk, or attachments held in memory.
+    attachments: List[Union[Path, "Attachment"]] = field(default_factory=list)
 
     def __post_init__(self):
-        if [self.html, self.plain_text] == [None, None]:
+        if [self._html, self._plain_text] == [None, None]:
             # TODO: Why?
             # raise Exception("html and plain_text fields cannot be both None.") 
             logging.warn("html and plain_text fields are both None.")
 
-@dataclass
+    def spill_body(self, spool: TextSpool):
+        """Move html and plain text to `spool`, e.g. once the mail is parsed and its body is rarely read."""
+        for name in ("html", "plain_text"):
+            text = getattr(self, name)
+            if text is not None:
+                setattr(self, name, spool.spill(text))
+
+
+@dataclass(slots=True)
 class ParsedMail:
     errors: List[str]
     mail: Mail
 
 
-@dataclass
+@dataclass(slots=True)
+class Attachment:
+    filename: str
+    data: bytes
+
+
+@dataclass(slots=True)
 class GmailAttachment:
-    ident: str
+    ident: Optional[str]
     filename: str
+    # Base64 data of attachments which Gmail inlines into the payload instead of giving an id.
+    data: Optional[str] = None
 
 
 class EmailPartExtractError(Exception):
@@ -49,40 +146,30 @@ def payload_to_mail(payload: dict, ident: str) -> ParsedMail:
     to = get_header(headers, "To")
     date = get_header(headers, "Date")
 
-    mime_type = payload["mimeType"]
-    plain_text_encoded = None
-    html_encoded = None
+    plain_text = None
+    html = None
     gmail_attachments = []
     errors = []
-    # TODO: Should be done recursively
-    if "multipart/" in mime_type:
-        # TODO: Looks ugly is buggy. Should implement/find DFS/BFS
-        for part in payload["parts"]:
-            mime_type = part["mimeType"]
-            if mime_type == "text/plain":
-                plain_text_encoded = part["body"]["data"]
-            elif mime_type == "text/html":
-                html_encoded = part["body"]["data"]
-            elif "image" in part["mimeType"] or "pdf" in part["mimeType"]:
-                att = GmailAttachment(ident=part["body"]["attachmentId"], filename=part["filename"])
-                gmail_attachments.append(att)
-            else:
-                errors.append(f"Unexpected mimeType: {mime_type}")
-
-    elif mime_type == "text/plain":
-        plain_text_encoded = payload["body"]["data"]
-    elif mime_type == "text/html":
-        html_encoded = payload["body"]["data"]
-    else:
-        raise RuntimeError(f"mime_type {mime_type} is unknown.")
-    
-    plain_text = None
-    if plain_text_encoded:
-        plain_text = base64.urlsafe_b64decode(plain_text_encoded).decode()
+    for part in iter_parts(payload):
+        mime_type = part["mimeType"]
+        body = part.get("body", {})
+        if part.get("filename") or "attachmentId" in body:
+            # Only a reference is kept, the data of large attachments is fetched when they are written.
+            gmail_attachments.append(
+                GmailAttachment(ident=body.get("attachmentId"), filename=part.get("filename") or "attachment", data=body.get("data"))
+            )
+        elif mime_type in ("text/plain", "text/html"):
+            if not body.get("data"):
+                continue
+            text = Base64Text(body["data"], charset=_charset(part))
+            # The first alternative of each type is the body, later ones are usually quoted or forwarded parts.
+            if mime_type == "text/plain" and plain_text is None:
+                plain_text = text
+            elif mime_type == "text/html" and html is None:
+                html = text
+        else:
+            errors.append(f"Unexpected mimeType: {mime_type}")
 
-    html = None
-    if html_encoded:
-        html = base64.urlsafe_b64decode(html_encoded).decode()
     return Mail(sender=parseaddr(sender)[1], 
                 to=parseaddr(to)[1], 
                 date=date, 
@@ -92,6 +179,30 @@ def payload_to_mail(payload: dict, ident: str) -> ParsedMail:
                 ident=ident), gmail_attachments, errors
 
 
+def iter_parts(payload: dict) -> Iterator[dict]:
+    """
+    Yield the leaf parts of a Gmail message payload in document order, descending into nested multiparts.
+    The tree is walked with an explicit stack, so deeply nested mails cannot exhaust the recursion limit.
+    """
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get("parts")
+        if part["mimeType"].startswith("multipart/") or children:
+            stack.extend(reversed(children or []))
+        else:
+            yield part
+
+
+def _charset(part: dict) -> str:
+    for header in part.get("headers", []):
+        if header["name"].lower() == "content-type":
+            message = email.message.Message()
+            message["Content-Type"] = header["value"]
+            return message.get_content_charset("utf-8")
+    return "utf-8"
+
+
 def get_header(headers: dict, name: str) -> str:
     return next((header["value"] for header in headers if header["name"] == name))
 
@@ -2,49 +2,121 @@ from __future__ import print_function
 from ast import parse
 
 import base64
+import json
 import logging
 import mimetypes
 import os
 import os.path
-from email import encoders
-from email.mime.base import MIMEBase
+import tempfile
+import threading
+import uuid
+from contextlib import suppress
+from email import policy
+from email.message import EmailMessage
 from email.mime.image import MIMEImage
-from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from itertools import islice
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, MediaIoBaseUpload
 
 from invoicer.config import Config
-from invoicer.mail import Mail, ParsedMail, from_gmail
-from invoicer.order import Order
+from invoicer.labels import LabelIds, LabelJournal
+from invoicer.mail import Attachment, GmailAttachment, Mail, ParsedMail, TextSpool, from_gmail
+from invoicer.order import Invoice, Order
 from invoicer.order_mail_parsers import order_from_mail
+from invoicer.processed import ProcessedMails
+from invoicer.utils import atomic_write
+
+
+# Gmail rejects batch requests with more than 100 calls and list pages larger than 500 mails.
+MAX_BATCH_SIZE = 100
+MAX_PAGE_SIZE = 500
+# batchModify accepts at most 1000 mail ids per request.
+MAX_BATCH_MODIFY = 1000
+INVOICED_LABEL = "Invoiced"
+FORWARDED_LABEL = "Forwarded"
+FORWARDED_WITH_ERRORS_LABEL = "Forwarded with Errors"
+# Searches of both flows run in threads of their own and update the same history file.
+_HISTORY_FILE_LOCK = threading.Lock()
+# Decoding base64 in slices of this many characters (a multiple of 4) bounds the decoded copy in memory.
+B64_DECODE_CHUNK = 4 * 1024 * 1024
+# Attachments are encoded in slices of whole 76 character base64 lines (57 bytes each).
+B64_ENCODE_CHUNK = 57 * 16 * 1024
+# Sent mails are uploaded in chunks of this size, which must be a multiple of 256 KiB.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Mails to be sent are built in memory up to this size, larger ones in a temporary file.
+MESSAGE_SPOOL_SIZE = 8 * 1024 * 1024
+# Mails added with only these labels are written by the bot itself and never need a search.
+OWN_MAIL_LABELS = {"SENT", "DRAFT"}
+# Of added labels, only moving a mail into the inbox can make it match a search.
+SEARCHED_ADDED_LABELS = {"INBOX"}
+
+
+class HistoryExpiredError(Exception):
+    pass
 
 
 class GmailAccount:
-    def __init__(self, oauth2_app_credentials_file: Path, token_file: Path) -> None:
+    def __init__(
+        self,
+        oauth2_app_credentials_file: Path,
+        token_file: Path,
+        batch_size: int = 50,
+        page_size: int = MAX_PAGE_SIZE,
+        max_results: Optional[int] = None,
+    ) -> None:
         # If modifying these scopes, delete the file token.json.
         self.scopes = [
             "https://www.googleapis.com/auth/gmail.modify",
             "https://www.googleapis.com/auth/gmail.settings.basic",
         ]
         creds = self._authorize(oauth2_app_credentials_file, token_file=token_file)
-        self.service = build("gmail", "v1", credentials=creds)
-
-    def create_label(self, name: str):
-        labels = self.get_labels()
-        for label in labels:
-            if name == label["name"]:
-                logging.info(
-                    f"Label '{name}' could not be created. It is already present."
-                )
-                return label["id"]
+        local = threading.local()
+
+        def build_request(http, *args, **kwargs):
+            # httplib2 connections are not thread-safe, so every thread sends requests through its own.
+            if not hasattr(local, "http"):
+                local.http = AuthorizedHttp(creds, http=httplib2.Http())
+            return HttpRequest(local.http, *args, **kwargs)
+
+        self._init(
+            service=build("gmail", "v1", credentials=creds, requestBuilder=build_request),
+            batch_size=batch_size,
+            page_size=page_size,
+            max_results=max_results,
+        )
 
+    @classmethod
+    def from_service(
+        cls, service, batch_size: int = 50, page_size: int = MAX_PAGE_SIZE, max_results: Optional[int] = None
+    ) -> "GmailAccount":
+        """Create an account on top of an already built Gmail service, skipping authorization."""
+        account = cls.__new__(cls)
+        account._init(service=service, batch_size=batch_size, page_size=page_size, max_results=max_results)
+        return account
+
+    def _init(self, service, batch_size: int, page_size: int, max_results: Optional[int]):
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"batch_size must be between 1 and {MAX_BATCH_SIZE}, got {batch_size}.")
+        if not 0 < page_size <= MAX_PAGE_SIZE:
+            raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}, got {page_size}.")
+        if max_results is not None and max_results <= 0:
+            raise ValueError(f"max_results must be positive, got {max_results}.")
+        self.service = service
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.max_results = max_results
+
+    def insert_label(self, name: str) -> str:
         label = {
             "labelListVisibility": "labelShow",
             "msgListVisibility": "labelHide",
@@ -82,67 +154,149 @@ class GmailAccount:
         return creds
 
     def search_mails(self, query: str) -> Tuple[ParsedMail]:
+        return tuple(self.iter_mails(query=query))
+
+    def iter_mails(self, query: str) -> Iterator[ParsedMail]:
+        """
+        Yield the mails matching `query`, fetching one batch of `batch_size` mails at a time.
+        The raw messages of a batch are released before the next batch is fetched, so a large search
+        only holds the mails its caller keeps.
+        """
         msg_ids = self._list_mail_ids(query=query)
-        gmails = self._get_mails(msg_ids=msg_ids)
-        mails = [self._get_mail(g) for g in gmails]
-        return tuple(mails)
+        while True:
+            chunk = list(islice(msg_ids, self.batch_size))
+            if len(chunk) == 0:
+                return
+            gmails, failures = self._get_mails(msg_ids=chunk)
+            for msg_id, error in failures.items():
+                # Unfetched mails stay unlabelled, so they are picked up again by the next search.
+                logging.error(f"Mail {msg_id} could not be fetched: {error}")
+            while gmails:
+                yield self._get_mail(gmails.pop(0))
 
     def _get_mail(self, gmail: dict) -> ParsedMail:
         mail, gmail_attachments, errors = from_gmail(gmail)
-        if len(gmail_attachments) > 0:
-            for gmail_attachment in gmail_attachments:
-                out_path = Path(gmail_attachment.filename)
-                self._get_attachment(
-                    msg_id=mail.ident, att_id=gmail_attachment.ident, out_path=out_path
-                )
-                mail.attachments.append(out_path)
-        
-        return ParsedMail(mail=mail, errors=errors)
+        used_names = set()
+        for gmail_attachment in gmail_attachments:
+            out_path = _attachment_path(msg_id=mail.ident, filename=gmail_attachment.filename, used_names=used_names)
+            try:
+                self._get_attachment(msg_id=mail.ident, attachment=gmail_attachment, out_path=out_path)
+            except HttpError as error:
+                errors.append(f"Attachment {gmail_attachment.filename} could not be fetched: {error}")
+                continue
+            mail.attachments.append(out_path)
 
-    def _get_attachment(self, msg_id: str, att_id: str, out_path: Path):
-        message = self.service.users().messages().get(userId="me", id=msg_id).execute()
-
-        for part in message['payload']['parts']:
-            if part['filename']:
-                if 'data' in part['body']:
-                    data = part['body']['data']
-                else:
-                    att_id = part['body']['attachmentId']
-                    att = self.service.users().messages().attachments().get(userId="me", messageId=msg_id, id=att_id).execute()
-                    data = att['data']
-                file_data = base64.urlsafe_b64decode(data.encode('UTF-8'))
-                out_path.write_bytes(file_data)
-
-    def _list_mail_ids(self, query: str) -> List[str]:
-        maxResults = 100
-        result = (
-            self.service.users()
-            .messages()
-            .list(userId="me", q=query, maxResults=maxResults)
-            .execute()
-        )
-        if result["resultSizeEstimate"] > maxResults:
-            # TODO: Convert to logging
-            logging.warning(
-                f"result['resultSizeEstimate']{result['resultSizeEstimate']} > maxResults{maxResults}"
-            )
-        elif result["resultSizeEstimate"] == 0:
-            return []
-
-        msg_ids = list(map(lambda m: m["id"], result["messages"]))
-        return msg_ids
+        return ParsedMail(mail=mail, errors=errors)
 
-    def _get_mails(self, msg_ids: List[str]):
-        mails = []
-        for msg_id in msg_ids:
-            result = (
+    def _get_attachment(self, msg_id: str, attachment: GmailAttachment, out_path: Path):
+        """
+        Write the decoded attachment to `out_path`. Attachments inlined in the already fetched payload
+        are decoded without a request, others are fetched once by their attachment id.
+        """
+        data = attachment.data
+        if data is None:
+            data = (
                 self.service.users()
                 .messages()
-                .get(userId="me", id=msg_id, format="full")
-                .execute()
+                .attachments()
+                .get(userId="me", messageId=msg_id, id=attachment.ident)
+                .execute()["data"]
             )
-            mails.append(result)
-        return mails
+        _write_b64(data=data, out_path=out_path)
+
+    def _list_mail_ids(self, query: str) -> Iterator[str]:
+        """
+        Yield ids of the mails matching `query`, following result pages of `page_size` mails
+        until the search is exhausted or `max_results` ids have been yielded.
+        """
+        messages = self.service.users().messages()
+        page_token = None
+        count = 0
+        while True:
+            page_size = self.page_size
+            if self.max_results is not None:
+                page_size = min(page_size, self.max_results - count)
+            result = messages.list(userId="me", q=query, maxResults=page_size, pageToken=page_token).execute()
+            for message in result.get("messages", []):
+                count += 1
+                yield message["id"]
+
+            page_token = result.get("nextPageToken")
+            if page_token is None:
+                return
+            if self.max_results is not None and count >= self.max_results:
+                logging.warning(
+                    f"Search is capped at {self.max_results} mails, the remaining mails are left for the next poll."
+                )
+                return
+
+    def get_history_id(self) -> str:
+        return self.service.users().getProfile(userId="me").execute()["historyId"]
+
+    def list_changed_mail_ids(self, start_history_id: str) -> Tuple[List[str], str]:
+        """
+        Return ids of mails that were added, lost a label or were moved into the inbox since `start_history_id`,
+        together with the current history id of the mailbox. Mails sent or drafted by the account are skipped.
+        Raise HistoryExpiredError if Gmail no longer keeps the history since `start_history_id`.
+        """
+        history = self.service.users().history()
+        request = history.list(
+            userId="me",
+            startHistoryId=start_history_id,
+            historyTypes=["messageAdded", "labelAdded", "labelRemoved"],
+            maxResults=MAX_PAGE_SIZE,
+        )
+        msg_ids = []
+        history_id = start_history_id
+        while request is not None:
+            try:
+                result = request.execute()
+            except HttpError as error:
+                if error.resp.status == 404:
+                    raise HistoryExpiredError(f"History since {start_history_id} is not available.") from error
+                raise
+            for record in result.get("history", []):
+                added_to_inbox = [
+                    change for change in record.get("labelsAdded", []) if set(change["labelIds"]) & SEARCHED_ADDED_LABELS
+                ]
+                for change in record.get("messagesAdded", []) + record.get("labelsRemoved", []) + added_to_inbox:
+                    message = change["message"]
+                    if not set(message.get("labelIds", [])) & OWN_MAIL_LABELS:
+                        msg_ids.append(message["id"])
+            history_id = result["historyId"]
+            request = history.list_next(request, result)
+        return list(dict.fromkeys(msg_ids)), history_id
+
+    def _get_mails(self, msg_ids: List[str]) -> Tuple[List[dict], Dict[str, Exception]]:
+        """
+        Fetch full messages with batch requests of at most `batch_size` calls each.
+        Return the fetched messages in the order of `msg_ids` and the errors of the
+        messages that could not be fetched, keyed by message id.
+        """
+        msg_ids = list(dict.fromkeys(msg_ids))
+        fetched = {}
+        failures = {}
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                failures[request_id] = exception
+            else:
+                fetched[request_id] = response
+
+        messages = self.service.users().messages()
+        for start in range(0, len(msg_ids), self.batch_size):
+            chunk = msg_ids[start : start + self.batch_size]
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for msg_id in chunk:
+                batch.add(messages.get(userId="me", id=msg_id, format="full"), request_id=msg_id)
+            try:
+                batch.execute()
+            except HttpError as error:
+                for msg_id in chunk:
+                    failures[msg_id] = error
+
+        mails = [fetched[msg_id] for msg_id in msg_ids if msg_id in fetched]
+        return mails, failures
 
     def add_label(self, mail_id: str, label_id: str):
         body = {"addLabelIds": [label_id]}
@@ -150,6 +304,13 @@ class GmailAccount:
             userId="me", id=mail_id, body=body
         ).execute()
 
+    def add_labels(self, mail_ids: Sequence[str], label_id: str):
+        """Add `label_id` to all `mail_ids` with a single request."""
+        if len(mail_ids) > MAX_BATCH_MODIFY:
+            raise ValueError(f"At most {MAX_BATCH_MODIFY} mails can be labelled at once, got {len(mail_ids)}.")
+        body = {"ids": list(mail_ids), "addLabelIds": [label_id]}
+        self.service.users().messages().batchModify(userId="me", body=body).execute()
+
     def send_mail(self, mail: Mail, delete_attachments=False):
         """Create and insert a draft email with attachment.
         Print the returned draft's message and id.
@@ -160,33 +321,16 @@ class GmailAccount:
         for guides on implementing OAuth2 for the application.
         """
         try:
-            # create a multipart message
-            mime_message = MIMEMultipart("related")
-
-            # headers
-            mime_message["To"] = mail.to
-            mime_message["From"] = mail.sender
-            mime_message["Subject"] = mail.subject
-            # mime_message["Content-Type"] = "text/html"
-
-            # Add the HTML message body
-            html = mail.html
-            text = MIMEText(html, "html")
-            mime_message.attach(text)
-            if mail.attachments:
-                for path in mail.attachments:
-                    attach_file(mime_message, path)
-
-            encoded_message = base64.urlsafe_b64encode(mime_message.as_bytes()).decode()
-
-            created_message = {"raw": encoded_message}
-            # pylint: disable=E1101
-            send_message = (
-                self.service.users()
-                .messages()
-                .send(userId="me", body=created_message)
-                .execute()
-            )
+            # Large messages are built in a temporary file and uploaded from it in chunks, so attachments
+            # of any size are never held in memory as a whole.
+            with tempfile.SpooledTemporaryFile(max_size=MESSAGE_SPOOL_SIZE) as message_file:
+                write_mime_message(mail=mail, out=message_file)
+                message_file.seek(0)
+                media = MediaIoBaseUpload(
+                    message_file, mimetype="message/rfc822", chunksize=UPLOAD_CHUNK_SIZE, resumable=True
+                )
+                # pylint: disable=E1101
+                send_message = self.service.users().messages().send(userId="me", media_body=media).execute()
             # logging.info(f'Mail has been sent. Message Id: {send_message["id"]}')
             ident = send_message["id"]
 
@@ -196,42 +340,173 @@ class GmailAccount:
         else:
             if delete_attachments:
                 for attachment in mail.attachments:
-                    os.remove(attachment)
+                    if isinstance(attachment, Path):
+                        os.remove(attachment)
         return ident
 
+class IncrementalSearch:
+    def __init__(self, mailing: GmailAccount, query: str, name: str, history_file: Optional[Path]) -> None:
+        """
+        Search mails matching `query`, but skip the search while the mailbox has no new, unlabelled
+        or un-archived mails since the last search that came back empty.
+        The history id of that search is stored under `name` in `history_file`, which can be shared
+        by several searches. Without a `history_file`, every call runs the full search.
+        """
+        self._mailing = mailing
+        self.query = query
+        self.name = name
+        self.history_file = history_file
+
+    def search(self) -> Tuple[ParsedMail]:
+        return tuple(self.iter_search())
+
+    def iter_search(self) -> Iterator[ParsedMail]:
+        """Like `search`, but yield mails as they are fetched. The history is only saved once all are yielded."""
+        if self.history_file is None:
+            yield from self._mailing.iter_mails(query=self.query)
+            return
+
+        history_id = self._load()
+        if history_id is not None:
+            try:
+                changed_ids, current_history_id = self._mailing.list_changed_mail_ids(start_history_id=history_id)
+            except HistoryExpiredError:
+                logging.warning(f"Mailbox history of '{self.name}' has expired, running a full search.")
+            else:
+                if len(changed_ids) == 0:
+                    self._save(current_history_id)
+                    return
+
+        # Taken before searching, so that mails arriving during the search show up in the next history.
+        search_history_id = self._mailing.get_history_id()
+        found = False
+        for mail in self._mailing.iter_mails(query=self.query):
+            found = True
+            yield mail
+        # Found mails are only done once they are labelled, so the history is not advanced and the
+        # next call searches again to pick up any mail that failed.
+        if not found:
+            self._save(search_history_id)
+
+    def _load(self) -> Optional[str]:
+        try:
+            with open(self.history_file, "r", encoding="utf-8") as f:
+                return json.load(f).get(self.name)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, history_id: str):
+        with _HISTORY_FILE_LOCK:
+            try:
+                with open(self.history_file, "r", encoding="utf-8") as f:
+                    history_ids = json.load(f)
+            except FileNotFoundError:
+                history_ids = {}
+            history_ids[self.name] = history_id
+
+            with atomic_write(self.history_file) as f:
+                json.dump(history_ids, f)
+
+
 # TODO: Change InvoicerAccount -> OrderAccount
 class InvoicerAccount:
     def __init__(self, cfg: Config, creds: Path, token: Path) -> None:
         super().__init__()
-        self.cfg = cfg
-        self._mailing = GmailAccount(oauth2_app_credentials_file=creds, token_file=token)
-        self.invoiced_label_id = self._mailing.create_label("Invoiced")
-        # TODO: Create MailLabel dataclass
-        self.forwarded_label_id = self._mailing.create_label("Forwarded")
-        self.forwarded_with_errors_label_id = self._mailing.create_label("Forwarded with Errors")
-
-    def search_new_orders(self) -> Tuple[Order]:
-        parsed_mails = self._mailing.search_mails(
-            query=f'from:{self.cfg.orderMail.sender} subject:"{self.cfg.orderMail.subjectHas}" -label:Invoiced'
+        mailing = GmailAccount(
+            oauth2_app_credentials_file=creds,
+            token_file=token,
+            batch_size=cfg.gmail.batchSize,
+            page_size=cfg.gmail.pageSize,
+            max_results=cfg.gmail.maxResults,
         )
+        self._init(cfg=cfg, mailing=mailing)
 
-        mails = []
-        for parsed_mail in parsed_mails:
-            # TODO: Handle here better.
-            assert len(parsed_mail.errors) == 0
-            mails.append(parsed_mail.mail)
-        
-        orders = tuple(map(order_from_mail, mails))
-        return orders
+    @classmethod
+    def from_mailing(cls, cfg: Config, mailing: GmailAccount) -> "InvoicerAccount":
+        """Create an account on top of an already authorized Gmail account."""
+        account = cls.__new__(cls)
+        account._init(cfg=cfg, mailing=mailing)
+        return account
 
-    def search_new_customer_mails(self) -> Tuple[ParsedMail]:
+    def _init(self, cfg: Config, mailing: GmailAccount):
+        self.cfg = cfg
+        self._mailing = mailing
+        self.label_journal = LabelJournal(Path(cfg.gmail.labelJournalFile))
+        self.processed = ProcessedMails(Path(cfg.processedMailsFile))
+        # Labels are looked up, or created, when a mail is first labelled.
+        label_cache_file = Path(cfg.gmail.labelCacheFile) if cfg.gmail.labelCacheFile else None
+        self.label_ids = LabelIds(mailing=self._mailing, cache_file=label_cache_file)
+
+        history_file = Path(cfg.gmail.historyFile) if cfg.gmail.incrementalSync else None
+        self._order_search = IncrementalSearch(
+            mailing=self._mailing,
+            query=f'from:{self.cfg.orderMail.sender} subject:"{self.cfg.orderMail.subjectHas}" -label:Invoiced',
+            name="orders",
+            history_file=history_file,
+        )
         senders_to_exclude = f"from:{self.cfg.orderMail.sender} from:me from:amazon.com from:amazonaws.com from:signup.aws from:google.com from:verify.signin.aws"
         labels_to_exclude = "label:Forwarded label:\"Forwarded with Errors\" label:Manual Forwarded"
         # TODO: After date fix to release date
-        mails = self._mailing.search_mails(
-            query=f"-{{{senders_to_exclude}}} in:inbox -{{{labels_to_exclude}}} after:2023/06/19"
+        self._customer_mail_search = IncrementalSearch(
+            mailing=self._mailing,
+            query=f"-{{{senders_to_exclude}}} in:inbox -{{{labels_to_exclude}}} after:2023/06/19",
+            name="customer_mails",
+            history_file=history_file,
         )
-        return mails
+
+    def search_new_orders(self) -> Iterator[Order]:
+        """
+        Yield orders of new order mails while the search is still fetching, one Gmail batch at a time.
+        Mail bodies are only read again for invoice mails, so they are moved to a temporary file as soon
+        as a mail is parsed, and a large backlog never holds more than one batch of bodies in memory.
+        """
+        spool = TextSpool()
+        # Stages are recorded for a batch of mails at a time, as mails are fetched.
+        parsed_ids = []
+        try:
+            for parsed_mail in self._without_pending_labels(self._order_search.iter_search()):
+                # TODO: Handle here better.
+                assert len(parsed_mail.errors) == 0
+                mail = parsed_mail.mail
+                order = order_from_mail(mail)
+                mail.spill_body(spool)
+                parsed_ids.append(mail.ident)
+                if len(parsed_ids) >= self._mailing.batch_size:
+                    self.processed.advance_many(parsed_ids, stage="parsed")
+                    parsed_ids = []
+                yield order
+        finally:
+            if parsed_ids:
+                self.processed.advance_many(parsed_ids, stage="parsed")
+
+    def search_new_customer_mails(self) -> Tuple[ParsedMail]:
+        return tuple(self._without_pending_labels(self._customer_mail_search.iter_search()))
+
+    def _without_pending_labels(self, parsed_mails: Iterable[ParsedMail]) -> Iterator[ParsedMail]:
+        # Labels of mails handled in an earlier cycle may not have reached Gmail yet.
+        self.flush_labels()
+        pending = self.label_journal.pending_mail_ids()
+        return (parsed_mail for parsed_mail in parsed_mails if parsed_mail.mail.ident not in pending)
+
+    def flush_labels(self):
+        """
+        Add the labels recorded in the label journal, one batchModify request per label and 1000 mails.
+        Labels that could not be added stay in the journal for the next flush.
+        """
+        for label, mail_ids in self.label_journal.pending().items():
+            for start in range(0, len(mail_ids), MAX_BATCH_MODIFY):
+                chunk = mail_ids[start : start + MAX_BATCH_MODIFY]
+                try:
+                    self._mailing.add_labels(mail_ids=chunk, label_id=self.label_ids.get(label))
+                except HttpError as error:
+                    logging.error(f"{len(chunk)} mails could not be labelled, retrying with the next flush: {error}")
+                    if error.resp.status in (400, 404):
+                        # The cached id may belong to a label deleted meanwhile.
+                        self.label_ids.invalidate()
+                    return
+                self.label_journal.remove(label=label, mail_ids=chunk)
+                if label == INVOICED_LABEL:
+                    self.processed.advance_many(chunk, stage="labelled")
 
     def forward_customer_mail(self, parsed_mail: ParsedMail) -> None:
         customer_mail = parsed_mail.mail
@@ -249,16 +524,20 @@ class InvoicerAccount:
             html=html,
             attachments=customer_mail.attachments
         )
-        self._mailing.send_mail(mail=mail, delete_attachments=True)
+        if self._mailing.send_mail(mail=mail, delete_attachments=True) is None:
+            # Unsent mails stay unlabelled, so they are forwarded by the next poll.
+            logging.error(f"Customer mail {customer_mail.ident} could not be forwarded.")
+            return
 
-        label_id = self.forwarded_label_id        
-        if len(errors) > 0:
-            label_id = self.forwarded_with_errors_label_id
+        # Attachments are downloaded into a directory per mail, which is empty after sending.
+        for directory in {attachment.parent for attachment in customer_mail.attachments}:
+            with suppress(OSError):
+                directory.rmdir()
 
-        self._mailing.add_label(
-           mail_id=customer_mail.ident,
-           label_id=label_id
-        )
+        label = FORWARDED_LABEL
+        if len(errors) > 0:
+            label = FORWARDED_WITH_ERRORS_LABEL
+        self.label_journal.add(mail_id=customer_mail.ident, label=label)
 
     def inform_customer_forwarded(self, customer_mail: Mail):
         # body = MailBodyGenerator.get_inform_forwarded_body(reply=reply, cfg=self.cfg)
@@ -278,20 +557,48 @@ class InvoicerAccount:
             # self.inform_customer_forwarded(reply)
             # self.gmail.label_mail(id=reply.id, label="Forwarded")
 
-    def send_invoice(self, order: Order, invoice: Path, delete_invoice=True, errors: Optional[List[str]] = None):
+    def send_invoice(self, order: Order, invoice: Invoice, errors: Optional[List[str]] = None):
+        if self.send_invoice_mail(order=order, invoice=invoice, errors=errors) is not None:
+            self.label_invoiced(order=order)
+
+    def send_invoice_mail(self, order: Order, invoice: Invoice, errors: Optional[List[str]] = None):
+        """Send the rendered `invoice` of order to the seller, attached straight from memory."""
         html = create_invoice_mail_body(salute_name=self.cfg.invoiceMail.saluteName, order=order, errors=errors)
+        attachments = [Attachment(filename=f"Invoice-{invoice.number}.docx", data=invoice.docx)]
+        if invoice.pdf is not None:
+            attachments.append(Attachment(filename=f"Invoice-{invoice.number}.pdf", data=invoice.pdf))
         mail = Mail(
             sender="me",
             to=self.cfg.invoiceMail.to,
-            subject=f"Neue Rechnung #{order.invoice.number}",
+            subject=f"Neue Rechnung #{invoice.number}",
             html=html,
-            attachments=[invoice]
+            attachments=attachments
         )
-        self._mailing.send_mail(mail=mail, delete_attachments=delete_invoice)
+        return self._mailing.send_mail(mail=mail)
 
-        self._mailing.add_label(mail_id=order.source_mail.ident, label_id=self.invoiced_label_id)
+    def label_invoiced(self, order: Order):
+        """Record the Invoiced label of the order mail. It is added to the mail by the next `flush_labels`."""
+        self.label_journal.add(mail_id=order.source_mail.ident, label=INVOICED_LABEL)
     
 
+def _attachment_path(msg_id: str, filename: str, used_names: set) -> Path:
+    # Only the base name of the sender-controlled filename is used, so it cannot point outside the directory.
+    name = Path(filename).name or "attachment"
+    if name in used_names:
+        name = f"{len(used_names)}-{name}"
+    used_names.add(name)
+
+    directory = Path(tempfile.gettempdir()) / "invoicer" / msg_id
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / name
+
+
+def _write_b64(data: str, out_path: Path):
+    with open(out_path, "wb") as f:
+        for start in range(0, len(data), B64_DECODE_CHUNK):
+            f.write(base64.urlsafe_b64decode(data[start : start + B64_DECODE_CHUNK]))
+
+
 def get_image(image_path, inline_reference):
     # Open the image file in binary mode
     with open(image_path, "rb") as f:
@@ -302,22 +609,53 @@ def get_image(image_path, inline_reference):
     return image
 
 
-def attach_file(mime_message, attachment_path):
-    # attachment
+def write_mime_message(mail: Mail, out: BinaryIO):
+    """
+    Write `mail` as a multipart/related MIME message with its html body and attachments to `out`.
+    Attachments are read and base64 encoded slice by slice.
+    """
+    boundary = f"==============={uuid.uuid4().hex}=="
+    message = EmailMessage()
+    message["To"] = mail.to
+    message["From"] = mail.sender
+    message["Subject"] = mail.subject
+    message["MIME-Version"] = "1.0"
+    message["Content-Type"] = f'multipart/related; boundary="{boundary}"'
+    # The line break before a boundary belongs to it, so parts need not end with one.
+    delimiter = f"\r\n--{boundary}\r\n".encode()
+
+    out.write(_header_block(message))
+    out.write(delimiter)
+    out.write(MIMEText(mail.html, "html").as_bytes(policy=policy.SMTP))
+    for attachment in mail.attachments:
+        out.write(delimiter)
+        if isinstance(attachment, Attachment):
+            out.write(_header_block(_attachment_headers(attachment.filename)))
+            data = memoryview(attachment.data)
+            for start in range(0, len(data), B64_ENCODE_CHUNK):
+                out.write(base64.encodebytes(data[start : start + B64_ENCODE_CHUNK]).replace(b"\n", b"\r\n"))
+        else:
+            out.write(_header_block(_attachment_headers(attachment.name)))
+            with open(attachment, "rb") as f:
+                while chunk := f.read(B64_ENCODE_CHUNK):
+                    out.write(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+    out.write(f"\r\n--{boundary}--\r\n".encode())
+
+
+def _attachment_headers(filename: str) -> EmailMessage:
     # guessing the MIME type
-    type_subtype, _ = mimetypes.guess_type(attachment_path.name)
-    maintype, subtype = type_subtype.split("/")
-
-    with open(attachment_path, "rb") as fp:
-        attachment_data = fp.read()
-    attachment = MIMEBase(maintype, subtype)
-    attachment.set_payload((attachment_data))
-    # encode the attachment
-    encoders.encode_base64(attachment)
-    attachment.add_header(
-        "Content-Disposition", "attachment", filename=attachment_path.name
-    )
-    mime_message.attach(attachment)
+    type_subtype, _ = mimetypes.guess_type(filename)
+    headers = EmailMessage()
+    headers["Content-Type"] = type_subtype or "application/octet-stream"
+    headers["Content-Disposition"] = "attachment"
+    headers.set_param("filename", filename, header="Content-Disposition")
+    headers["Content-Transfer-Encoding"] = "base64"
+    return headers
+
+
+def _header_block(message: EmailMessage) -> bytes:
+    headers, _, _ = message.as_bytes(policy=policy.SMTP).partition(b"\r\n\r\n")
+    return headers + b"\r\n\r\n"
 
 
 def create_invoice_mail_body(salute_name: str, order: Order, errors: Optional[List[str]] = None):
@@ -0,0 +1,88 @@
+import logging
+import sqlite3
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from invoicer.sqlite import SqliteStore
+from invoicer.utils import prepend_zeros
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sequences (
+    year INTEGER PRIMARY KEY,
+    last_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS invoice_numbers (
+    number TEXT PRIMARY KEY,
+    year INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    order_key TEXT UNIQUE,
+    reserved_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+class InvoiceNumberAllocator(SqliteStore):
+    def __init__(self, path: Path, start_count: int, legacy_count_file: Optional[Path] = Path(".last_invoice_count")) -> None:
+        """
+        Hand out invoice numbers from per-year sequences stored in an SQLite database at `path`.
+        Every number is recorded with the key of the order it went to, and reserving again for the same
+        order returns the same number, so a restart neither skips nor reuses numbers.
+        The first year of a new database continues from `legacy_count_file` if present, else from `start_count`.
+        Sequences of later years start at 1.
+        """
+        super().__init__(path, SCHEMA)
+        self.start_count = start_count
+        self.legacy_count_file = legacy_count_file
+
+    def reserve(self, year: int, order_key: Optional[str] = None) -> str:
+        return self.reserve_many([(year, order_key)])[0]
+
+    def reserve_many(self, requests: Sequence[Tuple[int, Optional[str]]]) -> List[str]:
+        """
+        Reserve a number for each (year, order key) pair in one transaction, in the given order.
+        Orders without a key always get a new number.
+        """
+        numbers = []
+        with self._transaction() as db:
+            for year, order_key in requests:
+                if order_key is not None:
+                    row = db.execute("SELECT number FROM invoice_numbers WHERE order_key = ?", (order_key,)).fetchone()
+                    if row is not None:
+                        numbers.append(row[0])
+                        continue
+
+                count = self._last_count(db, year) + 1
+                number = str(year) + prepend_zeros(value=str(count), num_min_digits=3)
+                db.execute("INSERT OR REPLACE INTO sequences (year, last_count) VALUES (?, ?)", (year, count))
+                db.execute(
+                    "INSERT INTO invoice_numbers (number, year, count, order_key) VALUES (?, ?, ?, ?)",
+                    (number, year, count, order_key),
+                )
+                numbers.append(number)
+        return numbers
+
+    def find(self, order_key: str) -> Optional[str]:
+        with self._transaction() as db:
+            row = db.execute("SELECT number FROM invoice_numbers WHERE order_key = ?", (order_key,)).fetchone()
+        return None if row is None else row[0]
+
+    def _last_count(self, db: sqlite3.Connection, year: int) -> int:
+        row = db.execute("SELECT last_count FROM sequences WHERE year = ?", (year,)).fetchone()
+        if row is not None:
+            return row[0]
+        if db.execute("SELECT 1 FROM sequences").fetchone() is not None:
+            return 0
+        return self._initial_count()
+
+    def _initial_count(self) -> int:
+        if self.legacy_count_file is not None:
+            try:
+                with open(self.legacy_count_file, "r", encoding="utf-8") as f:
+                    count = int(f.read())
+            except FileNotFoundError:
+                pass
+            else:
+                logging.info(f"Invoice numbers continue from {self.legacy_count_file}: {count}")
+                return count
+        return self.start_count
@@ -1,18 +1,20 @@
 from dataclasses import dataclass, field
+from decimal import Decimal
 from typing import List, Optional
 
 
 from invoicer.mail import Mail
+from invoicer.utils import from_cents, to_cents
 
 
-@dataclass
+@dataclass(slots=True)
 class Customer:
     name: str
     email: str
     phone: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Address:
     full_name: str
     address: str
@@ -20,7 +22,7 @@ class Address:
     email: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Invoice:
     address: Address
     number: Optional[str] = None
@@ -29,7 +31,7 @@ class Invoice:
     pdf: Optional[bytes] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Item:
     count: int
     description: str
@@ -37,21 +39,52 @@ class Item:
     tax_rate: float = 0.07
     unit: str = "Stck."
 
-    unit_price_net: float = field(init=False)
-    unit_price_gross: float = field(init=False)
-    total_price_net: float = field(init=False)
-    total_price_gross: float = field(init=False)
-    tax: float = field(init=False)
+    # `price` is the gross total of the line. Amounts are exact integer cents, the net amount is rounded
+    # half up per line and the tax is the rest, so net and tax always add up to the gross price.
+    gross_cents: int = field(init=False)
+    net_cents: int = field(init=False)
 
     def __post_init__(self):
-        self.total_price_net = self.price / (1 + self.tax_rate)
-        self.total_price_gross = self.price
-        self.tax = self.total_price_gross - self.total_price_net
-        self.unit_price_gross = self.total_price_gross / self.count
-        self.unit_price_net = self.total_price_net / self.count
+        self.gross_cents = to_cents(self.price)
+        self.net_cents = net_cents(self.gross_cents, tax_rate_basis_points(self.tax_rate))
 
+    # Amounts for display are derived on access, so large orders only keep the cents in memory.
+    @property
+    def tax_cents(self) -> int:
+        return self.gross_cents - self.net_cents
 
-@dataclass
+    @property
+    def total_price_net(self) -> Decimal:
+        return from_cents(self.net_cents)
+
+    @property
+    def total_price_gross(self) -> Decimal:
+        return from_cents(self.gross_cents)
+
+    @property
+    def tax(self) -> Decimal:
+        return from_cents(self.tax_cents)
+
+    @property
+    def unit_price_net(self) -> Decimal:
+        return self.total_price_net / self.count
+
+    @property
+    def unit_price_gross(self) -> Decimal:
+        return self.total_price_gross / self.count
+
+
+def tax_rate_basis_points(tax_rate: float) -> int:
+    return round(tax_rate * 10000)
+
+
+def net_cents(gross_cents: int, tax_rate_basis_points: int) -> int:
+    """Net amount of a gross amount, rounded half up to whole cents with integer arithmetic only."""
+    divisor = 10000 + tax_rate_basis_points
+    return (gross_cents * 20000 + divisor) // (2 * divisor)
+
+
+@dataclass(slots=True)
 class Customer:
     name: str
     surname: str
@@ -60,7 +93,7 @@ class Customer:
         return f"{self.name} {self.surname}"
 
 
-@dataclass
+@dataclass(slots=True)
 class Order:
     source_mail: Optional[Mail] = None
     number: Optional[str] = None
@@ -1,109 +1,136 @@
-import gettext
 import logging
 import re
-from typing import Callable, List
-
-import pycountry
+from typing import Dict, List, Optional, Tuple
 
+from invoicer.countries import DEFAULT_LOCALES, country_codes
 from invoicer.mail import Mail
 from invoicer.order import Address, Customer, Invoice, Item, Order
-
-
-def handle_exception(finder: Callable):
-    def inner(self, *wargs, **kwargs):
-        try:
-            return finder(self, *wargs, **kwargs)
-        except Exception:
-            # TODO: Reduce exception scope?
-            logging.exception("Finder exception")
-            return None
-
-    return inner
+from invoicer.providers import PROVIDERS, ProviderRegistry
+
+
+PRICE = r"\d{1,3}(?:\.\d{3})+,\d{2}|\d+,\d{2}"
+CUSTOMER = re.compile(r"von (.+), (.+)")
+# One alternative per field, named after it, so a single scan of the body finds all of them.
+# Long items wrap onto following lines, which is why items are matched across line breaks.
+ORDER_FIELDS = re.compile(
+    r"^(?:"
+    rf'(?P<count>\d+) x "(?P<description>[^"]+)"[ \t]*(?:\([^)]*\))?\s*:\s*(?P<item>{PRICE})\s*€'
+    r"|[^\r\n]*?Du hast eine Bestellung \((?P<order_number>\d+)\) über deinen Online-Shop"
+    rf"|Versandkosten \(inkl\. MwSt\.\): (?P<shipping_cost>{PRICE}) €"
+    r"|Bezahlmethode: (?P<payment_method>[^\r\n]+)"
+    r"|\*Rechnung(?:sadresse|s- und Versandadresse)\*\r?\n(?P<address_lines>(?:[^\r\n]+(?:\r?\n|$))+)"
+    r")",
+    flags=re.M,
+)
+EMAIL = re.compile(r"[a-zA-Z0-9+._-]+@[a-zA-Z0-9._-]+\.[a-zA-Z0-9_-]+")
 
 
 class OrderMailParser:
     def __init__(self, subject: str, body: str) -> None:
         """
         Given subject and body of text involving order details, extract necessary information out of it.
-        If extraction fails, log error and return None.
+        The body is scanned once, when the parser is created. Fields that cannot be extracted are logged and returned as None.
         """
-        self.body = body 
-        self.body = self.body.replace("<br/>", "\r\n")
-        self.body = self.body.replace("\r", "\\r").replace("\n", "\\n")
-
+        self.body = body.replace("<br/>", "\r\n")
         self.subject = subject
+        self._fields = _extract(self.body)
 
-    @handle_exception
-    def find_customer(self):
-        p = re.compile("von (.+), (.+)")
-        result = p.search(self.subject)
+    def find_customer(self) -> Optional[Customer]:
+        result = CUSTOMER.search(self.subject)
+        if result is None:
+            logging.error(f"Customer is not found in subject: {self.subject}")
+            return None
         surname = result.group(1)
         name = result.group(2)
         return Customer(name, surname)
 
-    @handle_exception
-    def find_items(self):
-        p = re.compile(r'(\d) x "(.+?)" .*?: (\d+,\d{2}) €')
-        return [
-            Item(count=int(m[0]), description=m[1].replace("\\r\\n", "\r\n"), price=float(m[2].replace(",", ".")))
-            for m in p.findall(self.body)
-        ]
-
-    @handle_exception
-    def find_order_number(self):
-        p = re.compile(r"Du hast eine Bestellung \((\d+)\) über deinen Online-Shop")
-        return p.search(self.body).group(1)
-
-    @handle_exception
-    def find_shipping_cost(self):
-        p = re.compile(r"Versandkosten \(inkl. MwSt.\): (\d+,\d{2}) €")
-        return float(p.search(self.body).group(1).replace(",", "."))
-
-    @handle_exception
-    def find_payment_method(self, short=True):
-        p = re.compile(r"Bezahlmethode: (.+)\\r\\n\\r\\n\*Rechnungs")
-        payment_method = p.search(self.body).group(1).rstrip()
-        if short:
-            return _simplify_payment_method(payment_method)
-        return payment_method
+    def find_items(self) -> List[Item]:
+        return self._fields["items"]
 
-    @handle_exception
-    def find_invoice_address(self):
-        p = re.compile(
-            r"Rechnung(?:sadresse|s- und Versandadresse)\*\\r\\n(.+\\r\\n[a-zA-Z0-9+._-]+@[a-zA-Z0-9._-]+\.[a-zA-Z0-9_-]+)",
-            flags=re.M,
-        )
+    def find_order_number(self) -> Optional[str]:
+        return self._field("order_number")
 
-        invoice_address = p.search(self.body).group(1)
-        invoice_address = invoice_address.replace("Tschechische Republik", "Czechia")  # Compatibility workaround TODO: Can be dangerous.
-        invoice_address_parts = invoice_address.split("\\r\\n")
+    def find_shipping_cost(self) -> Optional[float]:
+        return self._field("shipping_cost")
 
-        country_index = find_country_index(invoice_address_parts)
-        residential_address_end_index = country_index
+    def find_payment_method(self, short=True) -> Optional[str]:
+        payment_method = self._field("payment_method")
+        if short and payment_method is not None:
+            return _simplify_payment_method(payment_method)
+        return payment_method
 
-        residential_address = "\n".join(
-            invoice_address_parts[1 : residential_address_end_index + 1]
-        )
+    def find_invoice_address(self) -> Optional[Address]:
+        address_lines = self._field("address_lines")
+        if address_lines is None:
+            return None
 
-        address = Address(full_name=invoice_address_parts[0], address=residential_address)
-        return address
+        address_lines = [line.replace("Tschechische Republik", "Czechia") for line in address_lines]  # Compatibility workaround TODO: Can be dangerous.
+        country_index = find_country_index(address_lines)
+        if country_index is None:
+            logging.error(f"No country is found in invoice address: {address_lines}")
+            return None
 
+        residential_address = "\n".join(address_lines[1 : country_index + 1])
+        return Address(full_name=address_lines[0], address=residential_address)
 
-    @handle_exception
-    def find_invoice(self):
+    def find_invoice(self) -> Invoice:
         # TODO: Fix this
         address = self.find_invoice_address()
         return Invoice(address=address)
-     
+
+    def _field(self, name: str):
+        value = self._fields.get(name)
+        if value is None:
+            logging.error(f"{name} is not found in order mail.")
+        return value
 
 
-def find_country_index(address: List[str]):
-    german = gettext.translation("iso3166", pycountry.LOCALES_DIR, languages=["de"])
-    german.install()
-    countries = tuple(map(lambda c: _(c.name), pycountry.countries))
-    for part in address:
+def _extract(body: str) -> Dict:
+    """
+    Collect order number, items, shipping cost, payment method and invoice address lines in a single scan of `body`.
+    The first occurrence of a field wins.
+    """
+    items = []
+    fields = {"items": items}
+    for m in ORDER_FIELDS.finditer(body):
+        field = m.lastgroup
+        if field == "item":
+            count, description, price = m.group("count", "description", "item")
+            items.append(Item(count=int(count), description=description, price=_parse_price(price)))
+        elif field in fields:
+            continue
+        elif field == "shipping_cost":
+            fields[field] = _parse_price(m.group(field))
+        elif field == "payment_method":
+            fields[field] = m.group(field).rstrip()
+        elif field == "address_lines":
+            fields[field] = _address_lines(m.group(field).splitlines())
+        else:
+            fields[field] = m.group(field)
+    return fields
+
+
+def _address_lines(lines: List[str]) -> List[str]:
+    # The address ends with the customer's email, or with the footer if there is none.
+    address_lines = []
+    for line in lines:
+        if line.startswith("--"):
+            break
+        address_lines.append(line)
+        if EMAIL.fullmatch(line.strip()):
+            break
+    return address_lines
+
+
+def _parse_price(price: str) -> float:
+    return float(price.replace(".", "").replace(",", "."))
+
+
+def find_country_index(address: List[str], locales: Tuple[str, ...] = DEFAULT_LOCALES) -> Optional[int]:
+    countries = country_codes(locales)
+    for i, part in enumerate(address):
         if part in countries:
-            return address.index(part)
+            return i
 
 
 def _simplify_payment_method(payment_method: str):
@@ -117,10 +144,14 @@ def _simplify_payment_method(payment_method: str):
     return payment_method
 
 
-def order_from_mail(mail: Mail):
+def order_from_mail(mail: Mail, registry: Optional[ProviderRegistry] = None) -> Order:
     """
     Find parser of provider and parse.
     """
+    return (registry or PROVIDERS).parse(mail)
+
+
+def parse_online_shop_mail(mail: Mail) -> Order:
     parser = OrderMailParser(subject=mail.subject, body=mail.plain_text)
     order = Order(
         source_mail=mail,
@@ -0,0 +1,112 @@
+import logging
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+
+class PdfConversionError(RuntimeError):
+    pass
+
+
+class PdfConverter:
+    def __init__(self, workers: int = 1, soffice: str = "soffice", timeout: float = 120) -> None:
+        """
+        Convert docx documents to PDF with headless LibreOffice, entirely offline.
+        Up to `workers` conversions run at once, each with a LibreOffice user profile of its own that is
+        kept between conversions, so only the first conversion of a worker pays for creating the profile.
+        Documents converted together are split among the workers, with a single LibreOffice run per worker.
+        """
+        if workers < 1:
+            raise ValueError(f"PDF conversion needs at least one worker, got {workers}.")
+        self.workers = workers
+        self.soffice = soffice
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._worker_dirs: Optional[queue.Queue] = None
+
+    def convert(self, docx: bytes) -> bytes:
+        pdf = self.convert_many([docx])[0]
+        if pdf is None:
+            raise PdfConversionError(f"{self.soffice} did not convert the document.")
+        return pdf
+
+    def convert_many(self, documents: Sequence[bytes]) -> List[Optional[bytes]]:
+        """
+        Return the PDF of each of `documents` in the same order, or None for documents LibreOffice did not convert.
+        Raise PdfConversionError if LibreOffice could not be run at all.
+        """
+        if len(documents) <= 1 or self.workers == 1:
+            return self._convert_chunk(documents)
+
+        chunk_size = -(-len(documents) // self.workers)
+        chunks = [documents[i : i + chunk_size] for i in range(0, len(documents), chunk_size)]
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            return [pdf for pdfs in pool.map(self._convert_chunk, chunks) for pdf in pdfs]
+
+    def _convert_chunk(self, documents: Sequence[bytes]) -> List[Optional[bytes]]:
+        if len(documents) == 0:
+            return []
+        worker_dirs = self._get_worker_dirs()
+        worker_dir = worker_dirs.get()
+        try:
+            return self._run(worker_dir, documents)
+        finally:
+            worker_dirs.put(worker_dir)
+
+    def _get_worker_dirs(self) -> queue.Queue:
+        # Created on first use, so processes that never convert leave nothing behind.
+        with self._lock:
+            if self._worker_dirs is None:
+                root = tempfile.mkdtemp(prefix="invoicer-pdf-")
+                weakref.finalize(self, shutil.rmtree, root, ignore_errors=True)
+                self._worker_dirs = queue.Queue()
+                for i in range(self.workers):
+                    self._worker_dirs.put(Path(root) / f"worker-{i}")
+            return self._worker_dirs
+
+    def _run(self, worker_dir: Path, documents: Sequence[bytes]) -> List[Optional[bytes]]:
+        in_dir = worker_dir / "in"
+        out_dir = worker_dir / "out"
+        for directory in (in_dir, out_dir):
+            shutil.rmtree(directory, ignore_errors=True)
+            directory.mkdir(parents=True)
+
+        in_paths = [in_dir / f"{i}.docx" for i in range(len(documents))]
+        for path, docx in zip(in_paths, documents):
+            path.write_bytes(docx)
+
+        command = [
+            self.soffice,
+            "--headless",
+            "--norestore",
+            "--nolockcheck",
+            f"-env:UserInstallation={(worker_dir / 'profile').as_uri()}",
+            "--convert-to",
+            "pdf",
+            "--outdir",
+            str(out_dir),
+            *map(str, in_paths),
+        ]
+        try:
+            process = subprocess.run(command, capture_output=True, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as error:
+            raise PdfConversionError(f"{self.soffice} could not convert {len(documents)} documents: {error}") from error
+
+        pdfs = []
+        for path in in_paths:
+            pdf_path = out_dir / path.with_suffix(".pdf").name
+            if pdf_path.exists():
+                pdfs.append(pdf_path.read_bytes())
+            else:
+                # Other documents of the same run are still used.
+                stderr = process.stderr.decode(errors="replace").strip()
+                logging.error(f"{self.soffice} did not convert {path.name} (exit code {process.returncode}): {stderr}")
+                pdfs.append(None)
+        logging.debug(f"{sum(pdf is not None for pdf in pdfs)} of {len(pdfs)} documents are converted to PDF.")
+        return pdfs
@@ -0,0 +1,178 @@
+import logging
+import queue
+import threading
+from collections import namedtuple
+from typing import Iterable, Iterator, Optional, Sequence
+
+from invoicer.config import PipelineCfg
+from invoicer.invoice import InvoiceGenerator
+from invoicer.mail_account import InvoicerAccount
+from invoicer.order import Order
+from invoicer.processed import STAGES, ProcessedMails
+
+
+# A stage with a `batch_size` above 1 is called with a list of up to that many items and returns a list
+# of results, one per item.
+Stage = namedtuple("Stage", ("name", "func", "workers", "batch_size"), defaults=(1,))
+PipelineResult = namedtuple("PipelineResult", ("done", "failed"))
+
+_END = object()
+
+
+def run_pipeline(items: Iterable, stages: Sequence[Stage], queue_size: int) -> PipelineResult:
+    """
+    Pass each item through `stages` in turn. Every stage runs its own worker threads and reads
+    from a queue bounded by `queue_size`, so slow stages apply backpressure to the ones before.
+    Items are fed from the calling thread in iteration order. An item whose stage raises is
+    logged and dropped, without reaching the remaining stages.
+    Batching stages take all items already waiting, up to their batch size, so batches grow
+    while the stage is slower than the ones before.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    lock = threading.Lock()
+    counts = {"done": 0, "failed": 0}
+
+    def count(key: str, n: int = 1):
+        with lock:
+            counts[key] += n
+
+    def take(stage: Stage, in_queue: queue.Queue):
+        batch = []
+        item = in_queue.get()
+        while item is not _END:
+            batch.append(item)
+            if len(batch) >= stage.batch_size:
+                break
+            try:
+                item = in_queue.get_nowait()
+            except queue.Empty:
+                break
+        # Each worker consumes exactly one end marker, a worker that took its marker stops after this batch.
+        return batch, item is _END
+
+    def work(stage: Stage, in_queue: queue.Queue, out_queue: queue.Queue):
+        ended = False
+        while not ended:
+            batch, ended = take(stage, in_queue)
+            if len(batch) == 0:
+                continue
+            try:
+                results = stage.func(batch) if stage.batch_size > 1 else [stage.func(batch[0])]
+            except Exception:
+                logging.exception(f"Pipeline stage '{stage.name}' failed.")
+                count("failed", len(batch))
+                continue
+            if out_queue is None:
+                count("done", len(results))
+            else:
+                for result in results:
+                    out_queue.put(result)
+
+    stage_threads = []
+    for i, stage in enumerate(stages):
+        if stage.workers < 1:
+            raise ValueError(f"Stage '{stage.name}' needs at least one worker, got {stage.workers}.")
+        out_queue = queues[i + 1] if i + 1 < len(stages) else None
+        threads = [
+            threading.Thread(target=work, args=(stage, queues[i], out_queue), name=f"{stage.name}-{n}", daemon=True)
+            for n in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        stage_threads.append(threads)
+
+    try:
+        for item in items:
+            queues[0].put(item)
+    finally:
+        # Stages are shut down front to back, so every item still in flight reaches the end.
+        for stage_queue, threads in zip(queues, stage_threads):
+            for _ in threads:
+                stage_queue.put(_END)
+            for thread in threads:
+                thread.join()
+
+    return PipelineResult(**counts)
+
+
+def process_orders(
+    orders: Iterable[Order],
+    invoicer_account: InvoicerAccount,
+    invoice_generator: InvoiceGenerator,
+    cfg: PipelineCfg,
+    processed: Optional[ProcessedMails] = None,
+) -> PipelineResult:
+    """
+    Render, send and label invoices of `orders`, overlapping the stages of different orders.
+    If the invoice generator has PDF output enabled, invoices are converted to PDF before sending, in
+    batches of all invoices rendered while the previous batch was converted, so that LibreOffice is
+    started once per batch rather than once per invoice.
+    Invoice numbers are reserved by a single worker, so they follow the order of `orders`.
+    An order is only labelled once its invoice mail has been sent.
+    With a `processed` store, the completed stages of each order mail are recorded, and orders whose
+    invoice was sent before are only labelled again.
+    """
+
+    pdf_converter = invoice_generator.pdf_converter
+
+    def mark(order: Order, stage: str):
+        if processed is not None:
+            processed.advance(order.source_mail.ident, stage=stage, invoice_number=order.invoice.number)
+
+    def number(order: Order):
+        invoice_generator.reserve_invoice_number(order)
+        mark(order, "numbered")
+        return order
+
+    def render(order: Order):
+        invoice, errors = invoice_generator.generate(order=order)
+        logging.info(f"Invoice #{invoice.number} is created")
+        if pdf_converter is None:
+            mark(order, "rendered")
+        return order, invoice, errors
+
+    def pdf(batch):
+        converted = invoice_generator.add_pdfs([invoice for _, invoice, _ in batch])
+        results = []
+        for (order, invoice, errors), succeeded in zip(batch, converted):
+            if not succeeded:
+                errors = errors + ["pdf"]
+            mark(order, "rendered")
+            results.append((order, invoice, errors))
+        return results
+
+    def send(rendered):
+        order, invoice, errors = rendered
+        ident = invoicer_account.send_invoice_mail(order=order, errors=errors, invoice=invoice)
+        if ident is None:
+            raise RuntimeError(f"Invoice #{order.invoice.number} could not be sent.")
+        mark(order, "sent")
+        return order
+
+    def label(order: Order):
+        invoicer_account.label_invoiced(order=order)
+
+    if processed is not None:
+        orders = _without_sent(orders, invoicer_account=invoicer_account, processed=processed)
+
+    stages = [Stage("number", number, 1), Stage("render", render, cfg.renderWorkers)]
+    if pdf_converter is not None:
+        # A single batch is split among the workers of the converter.
+        stages.append(Stage("pdf", pdf, 1, batch_size=cfg.queueSize))
+    stages.append(Stage("send", send, cfg.sendWorkers))
+    stages.append(Stage("label", label, cfg.labelWorkers))
+    return run_pipeline(items=orders, stages=stages, queue_size=cfg.queueSize)
+
+
+def _without_sent(orders: Iterable[Order], invoicer_account: InvoicerAccount, processed: ProcessedMails) -> Iterator[Order]:
+    # An order mail found again after its invoice was sent has lost its label, e.g. by a crash
+    # before the label was recorded. Its invoice must not be sent twice.
+    # Orders are checked one by one, so orders still being searched are not waited for.
+    for order in orders:
+        stage = processed.stages([order.source_mail.ident]).get(order.source_mail.ident)
+        if stage is not None and STAGES.index(stage) >= STAGES.index("sent"):
+            number = processed.invoice_number(order.source_mail.ident)
+            logging.warning(f"Invoice #{number} of mail {order.source_mail.ident} was already sent, labelling it again.")
+            invoicer_account.label_invoiced(order=order)
+        else:
+            yield order
@@ -0,0 +1,59 @@
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from invoicer.sqlite import SqliteStore
+
+
+# Stages an order mail goes through, in order.
+STAGES = ("parsed", "numbered", "rendered", "sent", "labelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_mails (
+    mail_id TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    invoice_number TEXT,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+class ProcessedMails(SqliteStore):
+    def __init__(self, path: Path) -> None:
+        """
+        Record the last completed stage of each order mail, keyed by its Gmail message id, in an SQLite
+        database at `path`. Stages only move forward, so a mail that was sent once stays sent even if it
+        shows up in a search again, e.g. because its label was lost.
+        """
+        super().__init__(path, SCHEMA)
+
+    def advance(self, mail_id: str, stage: str, invoice_number: Optional[str] = None) -> None:
+        self.advance_many([mail_id], stage=stage, invoice_number=invoice_number)
+
+    def advance_many(self, mail_ids: Iterable[str], stage: str, invoice_number: Optional[str] = None) -> None:
+        rank = STAGES.index(stage)
+        with self._transaction() as db:
+            for mail_id in mail_ids:
+                row = db.execute("SELECT stage FROM processed_mails WHERE mail_id = ?", (mail_id,)).fetchone()
+                if row is not None and STAGES.index(row[0]) >= rank:
+                    continue
+                db.execute(
+                    "INSERT INTO processed_mails (mail_id, stage, invoice_number) VALUES (?, ?, ?) "
+                    "ON CONFLICT (mail_id) DO UPDATE SET stage = excluded.stage, "
+                    "invoice_number = COALESCE(excluded.invoice_number, invoice_number), updated_at = CURRENT_TIMESTAMP",
+                    (mail_id, stage, invoice_number),
+                )
+
+    def stages(self, mail_ids: Iterable[str]) -> Dict[str, str]:
+        """Return the last completed stage of each of `mail_ids` that has one."""
+        with self._transaction() as db:
+            stages = {}
+            for mail_id in mail_ids:
+                row = db.execute("SELECT stage FROM processed_mails WHERE mail_id = ?", (mail_id,)).fetchone()
+                if row is not None:
+                    stages[mail_id] = row[0]
+        return stages
+
+    def invoice_number(self, mail_id: str) -> Optional[str]:
+        with self._transaction() as db:
+            row = db.execute("SELECT invoice_number FROM processed_mails WHERE mail_id = ?", (mail_id,)).fetchone()
+        return None if row is None else row[0]
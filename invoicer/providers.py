@@ -0,0 +1,86 @@
+import importlib
+import logging
+import re
+from collections import namedtuple
+from typing import Callable, Dict, List, Optional
+
+from invoicer.mail import Mail
+from invoicer.order import Order
+
+
+# `parser` is the import path of a function turning a Mail into an Order, e.g.
+# "invoicer.order_mail_parsers:parse_online_shop_mail".
+# `senders` and `subject_prefixes` are tuples, empty ones and a None `marker` match any mail.
+ShopProvider = namedtuple("ShopProvider", ("name", "parser", "senders", "subject_prefixes", "marker"))
+
+# Order mails are often forwarded to the invoicer account.
+FORWARD_PREFIX = re.compile(r"^(?:(?:Fwd|Fw|WG|Re|AW):\s*)+", flags=re.I)
+
+
+class ProviderRegistry:
+    def __init__(self, default: Optional[str] = None) -> None:
+        """
+        Find the shop provider of order mails by cheap checks of sender, subject prefix and a marker string
+        in the body. Providers are looked up by sender in a table built when they are registered, so a mail is
+        only checked against providers which could have sent it. Parsers are imported on their first use.
+        Mails no provider matches are parsed by the `default` provider, if given.
+        """
+        self.default = default
+        self._providers: Dict[str, ShopProvider] = {}
+        self._by_sender: Dict[str, List[ShopProvider]] = {}
+        self._any_sender: List[ShopProvider] = []
+        self._candidates: Dict[str, List[ShopProvider]] = {}
+        self._parsers: Dict[str, Callable[[Mail], Order]] = {}
+
+    def register(self, provider: ShopProvider) -> None:
+        if provider.name in self._providers:
+            raise ValueError(f"Shop provider '{provider.name}' is already registered.")
+        self._providers[provider.name] = provider
+        if provider.senders:
+            for sender in provider.senders:
+                self._by_sender.setdefault(sender.lower(), []).append(provider)
+        else:
+            self._any_sender.append(provider)
+        # Providers of the sender come first, so they win over providers matching any sender.
+        self._candidates = {sender: providers + self._any_sender for sender, providers in self._by_sender.items()}
+
+    def find(self, mail: Mail) -> Optional[ShopProvider]:
+        subject = FORWARD_PREFIX.sub("", mail.subject)
+        body = mail.plain_text or mail.html or ""
+        for provider in self._candidates.get(mail.sender.lower(), self._any_sender):
+            if provider.subject_prefixes and not subject.startswith(provider.subject_prefixes):
+                continue
+            if provider.marker is not None and provider.marker not in body:
+                continue
+            return provider
+
+        if self.default is not None:
+            logging.warning(f"No shop provider matches mail {mail.ident} from {mail.sender}, using '{self.default}'.")
+            return self._providers[self.default]
+        return None
+
+    def parser(self, provider: ShopProvider) -> Callable[[Mail], Order]:
+        parser = self._parsers.get(provider.name)
+        if parser is None:
+            module_name, _, attr = provider.parser.partition(":")
+            parser = getattr(importlib.import_module(module_name), attr)
+            self._parsers[provider.name] = parser
+        return parser
+
+    def parse(self, mail: Mail) -> Order:
+        provider = self.find(mail)
+        if provider is None:
+            raise LookupError(f"No shop provider matches mail {mail.ident} from {mail.sender}.")
+        return self.parser(provider)(mail)
+
+
+PROVIDERS = ProviderRegistry(default="online_shop")
+PROVIDERS.register(
+    ShopProvider(
+        name="online_shop",
+        parser="invoicer.order_mail_parsers:parse_online_shop_mail",
+        senders=(),
+        subject_prefixes=("Neue Bestellung",),
+        marker="über deinen Online-Shop",
+    )
+)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Callable
+
+from invoicer.config import Config
+from invoicer.invoice import InvoiceGenerator
+from invoicer.mail_account import InvoicerAccount
+from invoicer.pipeline import process_orders
+
+
+class Invoicer:
+    def __init__(self, cfg: Config, account: InvoicerAccount, generator: InvoiceGenerator) -> None:
+        """
+        Run the order flow and the customer mail flow as independent tasks, each polling with its
+        own interval. A failing flow is retried with exponential backoff without affecting the other.
+        """
+        self.cfg = cfg
+        self.account = account
+        self.generator = generator
+        self._stopping = None
+        self._stop_requested = False
+
+    def process_new_orders(self):
+        logging.info(f"Searching for orders...")
+        # Orders are invoiced while the search is still fetching them.
+        result = process_orders(
+            orders=self.account.search_new_orders(),
+            invoicer_account=self.account,
+            invoice_generator=self.generator,
+            cfg=self.cfg.pipeline,
+            processed=self.account.processed,
+        )
+        if result.done + result.failed > 0:
+            logging.info(f"{result.done} invoices are sent, {result.failed} failed.")
+        else:
+            logging.info(f"No new orders are found.")
+        # Also labels orders found again after their invoice was sent.
+        self.account.flush_labels()
+
+    def forward_new_customer_mails(self):
+        logging.info("Searching for customer emails...")
+        customer_mails = self.account.search_new_customer_mails()
+        if len(customer_mails) > 0:
+            logging.info(f"{len(customer_mails)} customer mails are found")
+            for customer_mail in customer_mails:
+                self.account.forward_customer_mail(parsed_mail=customer_mail)
+                logging.info(f"Customer mail was forwarded to seller.")
+            self.account.flush_labels()
+        else:
+            logging.info("No new customer emails are found.")
+
+    async def run(self):
+        """Run both flows until `stop` is called. Flow cycles in progress are finished before returning."""
+        self._stopping = asyncio.Event()
+        if self._stop_requested:
+            self._stopping.set()
+
+        customer_mail_interval = self.cfg.customerMailPollInterval or self.cfg.pollInterval
+        await asyncio.gather(
+            self._run_flow("Order flow", self.process_new_orders, self.cfg.pollInterval),
+            self._run_flow("Customer mail flow", self.forward_new_customer_mails, customer_mail_interval),
+        )
+        logging.info("Invoicer is stopped.")
+
+    def stop(self):
+        logging.info("Stopping Invoicer after the running cycles...")
+        self._stop_requested = True
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def _run_flow(self, name: str, flow: Callable[[], None], interval: float):
+        failures = 0
+        while not self._stopping.is_set():
+            try:
+                # Flows block on Gmail and python-docx, so they run in worker threads.
+                await asyncio.to_thread(flow)
+            except Exception:
+                failures += 1
+                delay = min(interval * 2**failures, self.cfg.maxRetryInterval)
+                logging.exception(f"{name} failed {failures} time(s) in a row. Retrying after {delay}s...")
+            else:
+                failures = 0
+                delay = interval
+                logging.info(f"{name} is waiting for {delay}s")
+
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
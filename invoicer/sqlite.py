@@ -0,0 +1,30 @@
+import sqlite3
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+
+class SqliteStore:
+    def __init__(self, path: Path, schema: str) -> None:
+        """
+        State kept in an SQLite database at `path`, created with the `schema` script on first use.
+        Every transaction opens a connection of its own, so a store can be used from any thread or
+        forked process, and takes the write lock up front, so concurrent writers are serialized.
+        """
+        self.path = path
+        self._schema = schema
+        self._schema_created = False
+
+    @contextmanager
+    def _transaction(self):
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as db:
+            db.execute("PRAGMA synchronous = FULL")
+            if not self._schema_created:
+                db.executescript(self._schema)
+                self._schema_created = True
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
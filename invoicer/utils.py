@@ -1,4 +1,9 @@
+import os
+import tempfile
+from contextlib import contextmanager, suppress
 from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
 from dateutil import parser
 from babel.numbers import format_currency
 
@@ -16,5 +21,34 @@ def eur(value: float):
     return format_currency(value, "EUR", locale="de_DE")
 
 
+def to_cents(value: float) -> int:
+    # Prices are read with two decimals, rounding undoes the binary float error.
+    return round(value * 100)
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+@contextmanager
+def atomic_write(path: Path, mode: str = "w"):
+    """
+    Write `path` through a uniquely named temporary file next to it, which replaces `path` once written.
+    Readers never see a partly written file, and writers in other threads or processes never share a temporary file.
+    """
+    path = Path(path)
+    f = tempfile.NamedTemporaryFile(
+        mode, encoding=None if "b" in mode else "utf-8", dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+    )
+    try:
+        with f:
+            yield f
+        os.replace(f.name, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(f.name)
+        raise
+
+
 def prepend_zeros(value: str, num_min_digits: int):
     return "0" * (num_min_digits - len(value)) + value
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""
+Compare fetching a poll's worth of mails one request per message against batched fetching.
+Every HTTP round trip to the fake Gmail transport costs `--latency` seconds.
+
+Run with: python -m tests.benchmark_gmail_fetch
+"""
+import argparse
+import time
+
+from invoicer.mail_account import GmailAccount
+from tests.fake_gmail import FakeGmailHttp, build_fake_service, make_message
+
+
+def _fetch_sequentially(account: GmailAccount, msg_ids):
+    messages = account.service.users().messages()
+    return [messages.get(userId="me", id=msg_id, format="full").execute() for msg_id in msg_ids]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mails", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    http = FakeGmailHttp(latency=args.latency)
+    msg_ids = [f"m{i}" for i in range(args.mails)]
+    for msg_id in msg_ids:
+        http.add_message(*make_message(ident=msg_id))
+    account = GmailAccount.from_service(build_fake_service(http), batch_size=args.batch_size)
+
+    start = time.perf_counter()
+    _fetch_sequentially(account, msg_ids)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    account._get_mails(msg_ids)
+    batched = time.perf_counter() - start
+
+    print(f"{args.mails} mails, {args.latency * 1000:.0f} ms per round trip")
+    print(f"sequential: {sequential:.3f}s")
+    print(f"batched (batch size {args.batch_size}): {batched:.3f}s ({sequential / batched:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare filling the item table of an invoice with python-docx row by row and styling every cell
+afterwards against appending copies of a single pre-styled row, for orders of 1, 50 and 500 items.
+
+Run with: python -m tests.benchmark_invoice_table
+"""
+import argparse
+import time
+from pathlib import Path
+
+from docx import Document
+
+from invoicer.invoice import (
+    ITEM_COLUMN_ALIGNMENTS,
+    TABLE_FONT,
+    _change_font,
+    _item_row_texts,
+    _replace_item_table,
+    align_column,
+)
+from invoicer.order import Item
+
+
+TEMPLATE = Path(__file__).parents[1] / "docs" / "template_sample.docx"
+
+
+def _row_by_row(t, items):
+    for i, item in enumerate(items):
+        row = t.add_row()
+        for cell, text in zip(row.cells, _item_row_texts(index=i + 1, item=item)):
+            cell.text = text
+    for column, alignment in zip(t.columns, ITEM_COLUMN_ALIGNMENTS):
+        align_column(column, alignment)
+    _change_font(t, TABLE_FONT)
+
+
+def _prototype_rows(t, items):
+    _replace_item_table(t=t, items=items, font=TABLE_FONT)
+
+
+def _seconds(fill, items, n: int) -> float:
+    # Opening the template is left out of the timing, it is the same for both.
+    documents = [Document(TEMPLATE) for _ in range(n)]
+    start = time.perf_counter()
+    for document in documents:
+        fill(document.tables[0], items)
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    # Filling 500 items row by row takes about a minute.
+    parser.add_argument("-n", type=int, default=1)
+    args = parser.parse_args()
+
+    for count in (1, 50, 500):
+        items = [Item(count=i % 9 + 1, description=f"Artikel {i}", price=9.99 * (i % 9 + 1)) for i in range(count)]
+        before = _seconds(_row_by_row, items, args.n)
+        after = _seconds(_prototype_rows, items, args.n)
+        print(f"{count:>4} items: row by row {before * 1000:8.1f} ms, prototype rows {after * 1000:7.1f} ms ({before / after:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Compare preparing invoice documents by re-opening the template and searching each placeholder
+against copying a pre-parsed template and replacing its indexed placeholders.
+
+Run with: python -m tests.benchmark_invoice_template
+"""
+import argparse
+import re
+import time
+from pathlib import Path
+
+from docx import Document
+
+from invoicer.config import Config, InvoiceMailCfg, OrderMailCfg
+from invoicer.invoice import InvoiceGenerator, Replacement
+
+
+TEMPLATE = Path(__file__).parents[1] / "docs" / "template_sample.docx"
+REPLACEMENTS = (
+    Replacement("{{address}}", "Max Mustermann\nMusterweg 1\n01234 Berlin"),
+    Replacement("{{date}}", "19.06.2023"),
+    Replacement("{{invoice_nr}}", "2023001"),
+    Replacement("{{salutation}}", "Sehr geehrter Herr Mustermann"),
+    Replacement("{{payment_method}}", "Vorkasse"),
+)
+# Placeholders of the sum table, which used to be replaced by setting the text of their cells.
+TABLE_REPLACEMENTS = (
+    Replacement("{{7_s_e}}", "1-3"),
+    Replacement("{{19_s_e}}", "4"),
+)
+
+
+# Placeholder replacement of the generator before templates were indexed.
+def paragraph_replace_text(paragraph, regex, replace_str):
+    """Return `paragraph` after replacing all matches for `regex` with `replace_str`.
+
+    `regex` is a compiled regular expression prepared with `re.compile(pattern)`
+    according to the Python library documentation for the `re` module.
+    """
+    # --- a paragraph may contain more than one match, loop until all are replaced ---
+    while True:
+        text = paragraph.text
+        match = regex.search(text)
+        if not match:
+            break
+
+        # --- when there's a match, we need to modify run.text for each run that
+        # --- contains any part of the match-string.
+        runs = iter(paragraph.runs)
+        start, end = match.start(), match.end()
+
+        # --- Skip over any leading runs that do not contain the match ---
+        for run in runs:
+            run_len = len(run.text)
+            if start < run_len:
+                break
+            start, end = start - run_len, end - run_len
+
+        # --- Match starts somewhere in the current run. Replace match-str prefix
+        # --- occurring in this run with entire replacement str.
+        run_text = run.text
+        run_len = len(run_text)
+        run.text = "%s%s%s" % (run_text[:start], replace_str, run_text[end:])
+        end -= run_len  # --- note this is run-len before replacement ---
+
+        # --- Remove any suffix of match word that occurs in following runs. Note that
+        # --- such a suffix will always begin at the first character of the run. Also
+        # --- note a suffix can span one or more entire following runs.
+        for run in runs:  # --- next and remaining runs, uses same iterator ---
+            if end <= 0:
+                break
+            run_text = run.text
+            run_len = len(run_text)
+            run.text = run_text[end:]
+            end -= run_len
+
+    # --- optionally get rid of any "spanned" runs that are now empty. This
+    # --- could potentially delete things like inline pictures, so use your judgement.
+    # for run in paragraph.runs:
+    #     if run.text == "":
+    #         r = run._r
+    #         r.getparent().remove(r)
+
+    return paragraph
+
+
+def _reopen_and_search():
+    invoice = Document(TEMPLATE)
+    for replacement in REPLACEMENTS:
+        paragraphs = [p.text for p in invoice.paragraphs]
+        index = next(i for i, p in enumerate(paragraphs) if replacement.old in p)
+        paragraph_replace_text(invoice.paragraphs[index], re.compile(replacement.old), replacement.new)
+    sum_table = invoice.tables[1]
+    for row, replacement in zip((2, 3), TABLE_REPLACEMENTS):
+        cell = sum_table.cell(row, 3)
+        cell.text = cell.text.replace(replacement.old, replacement.new)
+    return invoice
+
+
+def _copy_and_replace(generator: InvoiceGenerator):
+    invoice = generator.template.new_document()
+    generator._replace(replacements=REPLACEMENTS + TABLE_REPLACEMENTS, invoice=invoice)
+    return invoice
+
+
+def _rate(func, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=50)
+    args = parser.parse_args()
+
+    cfg = Config(
+        orderMail=OrderMailCfg(subjectHas="Neue Bestellung", sender="shop@example.com"),
+        invoiceMail=InvoiceMailCfg(to="seller@example.com", saluteName="Max"),
+        invoiceCountStart=0,
+        pollInterval=60,
+    )
+    generator = InvoiceGenerator(cfg=cfg, template_path=TEMPLATE)
+    before = _rate(_reopen_and_search, args.n)
+    after = _rate(lambda: _copy_and_replace(generator), args.n)
+    print(f"re-open template: {before:.1f} invoices/s")
+    print(f"cached template:  {after:.1f} invoices/s ({after / before:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
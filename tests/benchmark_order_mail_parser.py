@@ -0,0 +1,92 @@
+"""
+Compare parsing order mails with one regex search per field over an escaped body
+against the single-pass extractor of OrderMailParser, over a corpus of synthetic order mails.
+
+Run with: python -m tests.benchmark_order_mail_parser
+"""
+import argparse
+import random
+import re
+import time
+
+from invoicer.order import Address, Item
+from invoicer.order_mail_parsers import OrderMailParser, find_country_index
+
+
+SUBJECT = "Neue Bestellung (1340) bei www.mustershop.de von Mustermann, Max"
+PLANTS = ("Salvia uliginosa", "Tricyrtis macranthopsis", "Corydalis calycosa", "Dicentra cucullaria 'Pittsburg'")
+
+
+def _synthetic_mail(rng: random.Random, n_items: int) -> str:
+    lines = [
+        "Hallo!", "", f"Du hast eine Bestellung ({rng.randint(1, 9999)}) über deinen Online-Shop",
+        "www.mustershop.de erhalten:", "", "==========", "",
+    ]
+    for _ in range(n_items):
+        count = rng.randint(1, 9)  # The previous item pattern only reads one digit.
+        price = f"{rng.randint(1, 99)},{rng.randint(0, 99):02d}"
+        item = f'{count} x "{rng.choice(PLANTS)} - {"Staude " * rng.randint(0, 4)}"'
+        # Some items wrap before their price, as long items do in real mails.
+        lines += [f"{item} :", f"{price} €"] if rng.random() < 0.3 else [f"{item} : {price} €"]
+    lines += [
+        "Summe für alle Artikel: 1,00 €", "", "==========", "", "Versandkosten (inkl. MwSt.): 5,90 €",
+        "Gesamtpreis (inkl. MwSt.): 6,90 €", "", "Bezahlmethode: Gegen Vorkasse", "",
+        "*Rechnungs- und Versandadresse*", "Max Mustermann", "Musterweg 1", "01234 Berlin", "Deutschland",
+        "info@max.mustermann.com", "--", "Diese Bestelldaten findest du auch in der Bestellübersicht.",
+    ]
+    lines += ["Lorem ipsum dolor sit amet, consetetur sadipscing elitr."] * 20
+    return "\r\n".join(lines)
+
+
+def _search_per_field(body: str):
+    """The previous approach: escape line breaks, then compile and search one pattern per field."""
+    body = body.replace("<br/>", "\r\n").replace("\r", "\\r").replace("\n", "\\n")
+    items = [
+        Item(count=int(m[0]), description=m[1].replace("\\r\\n", "\r\n"), price=float(m[2].replace(",", ".")))
+        for m in re.compile(r'(\d) x "(.+?)" .*?: (\d+,\d{2}) €').findall(body)
+    ]
+    number = re.compile(r"Du hast eine Bestellung \((\d+)\) über deinen Online-Shop").search(body).group(1)
+    shipping = float(re.compile(r"Versandkosten \(inkl. MwSt.\): (\d+,\d{2}) €").search(body).group(1).replace(",", "."))
+    payment = re.compile(r"Bezahlmethode: (.+)\\r\\n\\r\\n\*Rechnungs").search(body).group(1).rstrip()
+    address = re.compile(
+        r"Rechnung(?:sadresse|s- und Versandadresse)\*\\r\\n(.+\\r\\n[a-zA-Z0-9+._-]+@[a-zA-Z0-9._-]+\.[a-zA-Z0-9_-]+)"
+    ).search(body).group(1).split("\\r\\n")
+    country_index = find_country_index(address)
+    address = Address(full_name=address[0], address="\n".join(address[1 : country_index + 1]))
+    return number, items, shipping, payment, address
+
+
+def _single_pass(body: str):
+    parser = OrderMailParser(subject=SUBJECT, body=body)
+    return (
+        parser.find_order_number(), parser.find_items(), parser.find_shipping_cost(),
+        parser.find_payment_method(), parser.find_invoice_address(),
+    )
+
+
+def _rate(func, mails) -> float:
+    start = time.perf_counter()
+    for mail in mails:
+        func(mail)
+    return len(mails) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=2000, help="number of synthetic mails")
+    parser.add_argument("--items", type=int, default=30, help="maximum number of items per mail")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    mails = [_synthetic_mail(rng, rng.randint(1, args.items)) for _ in range(args.n)]
+    before = _rate(_search_per_field, mails)
+    after = _rate(_single_pass, mails)
+    print(f"search per field: {before:.0f} mails/s, {sum(len(_search_per_field(m)[1]) for m in mails)} items found")
+    print(
+        f"single pass:      {after:.0f} mails/s, {sum(len(_single_pass(m)[1]) for m in mails)} items found"
+        f" ({after / before:.1f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Measure the memory of searching and parsing a large backlog of order mails from a fake Gmail account:
+the peak while searching and what the parsed orders keep afterwards. Orders are either collected
+from a search that fetches all mails first, or streamed by InvoicerAccount.search_new_orders, which
+fetches one batch at a time and moves each mail body to a temporary file once it is parsed.
+
+Run with: python -m tests.benchmark_order_memory
+"""
+import argparse
+import gc
+import logging
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from invoicer.config import Config, GmailCfg, InvoiceMailCfg, OrderMailCfg
+from invoicer.mail_account import GmailAccount, InvoicerAccount
+from invoicer.order_mail_parsers import order_from_mail
+from tests.fake_gmail import FakeGmailHttp, build_fake_service, make_message
+from tests.test_order_mail_parser import MAIL_BODY, MAIL_SUBJECT
+
+
+def _fetched_first(account: InvoicerAccount):
+    # Orders as they were searched before: all raw mails fetched, then all parsed, then all turned into orders.
+    mailing = account._mailing
+    gmails, _ = mailing._get_mails(msg_ids=list(mailing._list_mail_ids(query=account._order_search.query)))
+    parsed_mails = [mailing._get_mail(gmail) for gmail in gmails]
+    return [order_from_mail(parsed_mail.mail) for parsed_mail in parsed_mails]
+
+
+def _streamed(account: InvoicerAccount):
+    return list(account.search_new_orders())
+
+
+def _measure(search, http: FakeGmailHttp, tmp_dir: Path):
+    cfg = Config(
+        orderMail=OrderMailCfg(subjectHas="Neue Bestellung", sender="shop@example.com"),
+        invoiceMail=InvoiceMailCfg(to="seller@example.com", saluteName="Max"),
+        invoiceCountStart=0,
+        pollInterval=60,
+        gmail=GmailCfg(incrementalSync=False, labelJournalFile=str(tmp_dir / "labels.sqlite3"), labelCacheFile=None),
+        processedMailsFile=str(tmp_dir / "processed.sqlite3"),
+    )
+    for path in tmp_dir.iterdir():
+        path.unlink()
+    account = InvoicerAccount.from_mailing(cfg, GmailAccount.from_service(build_fake_service(http)))
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    orders = search(account)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(orders), kept, peak, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=10000)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    http = FakeGmailHttp()
+    for i in range(args.orders):
+        html = MAIL_BODY.replace("\r\n", "<br/>")
+        http.add_message(*make_message(ident=f"m{i}", subject=MAIL_SUBJECT, plain_text=f"{MAIL_BODY}{i}", html=f"{html}{i}"))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, search in (("fetched first", _fetched_first), ("streamed", _streamed)):
+            count, kept, peak, seconds = _measure(search, http, Path(tmp_dir))
+            print(
+                f"{name:14s} {count} orders in {seconds:5.1f}s: "
+                f"peak {peak / count:8.0f} bytes per order, kept {kept / count:8.0f} bytes per order"
+            )
+
+
+if __name__ == "__main__":
+    main()
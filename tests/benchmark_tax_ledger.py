@@ -0,0 +1,61 @@
+"""
+Compare totalling invoices per tax rate with float sums, one pass per total, against integer-cent
+ledgers, for a year of invoices as in a year-end audit.
+
+Run with: python -m tests.benchmark_tax_ledger
+"""
+import argparse
+import random
+import time
+
+from invoicer.ledger import TaxLedger
+from invoicer.order import Item
+
+
+def _float_sums(items):
+    # Net and tax of each line as Item computed them before, in floats.
+    def get_sum(tax_rate: float, attr: str):
+        nets = [item.price / (1 + item.tax_rate) for item in items if item.tax_rate == tax_rate]
+        if attr == "net":
+            return sum(nets)
+        return sum(item.price for item in items if item.tax_rate == tax_rate) - sum(nets)
+
+    return (get_sum(0.07, "net"), get_sum(0.19, "net"), get_sum(0.07, "tax"), get_sum(0.19, "tax"))
+
+
+def _ledger(items):
+    totals = TaxLedger.from_items(items).totals()
+    return tuple(totals[rate].net for rate in (0.07, 0.19)) + tuple(totals[rate].tax for rate in (0.07, 0.19))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--invoices", type=int, default=5000)
+    parser.add_argument("--items", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    invoices = []
+    for _ in range(args.invoices):
+        items = [Item(count=rng.randint(1, 9), description="Pflanze", price=rng.randint(100, 9999) / 100) for _ in range(args.items)]
+        items.append(Item(count=1, description="Verpackung & Lieferung", price=4.9, tax_rate=0.19))
+        invoices.append(items)
+
+    for name, total in (("float sums", _float_sums), ("ledger", _ledger)):
+        start = time.perf_counter()
+        for items in invoices:
+            total(items)
+        print(f"{name:>10}: {time.perf_counter() - start:.3f} s for {args.invoices} invoices")
+
+    start = time.perf_counter()
+    year = TaxLedger()
+    for items in invoices:
+        year.add_items(items)
+    totals = year.totals()
+    print(f"year ledger: {time.perf_counter() - start:.3f} s for {len(year)} lines")
+    for rate, total in totals.items():
+        print(f"  {rate:.0%}: net {total.net / 100:.2f}, tax {total.tax / 100:.2f}, gross {total.gross / 100:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+A local, in-memory stand-in for the Gmail HTTP API.
+
+`FakeGmailHttp` implements the subset of the httplib2 interface used by googleapiclient,
+so a real Gmail service can be built on top of it with `build_fake_service`. Every HTTP
+round trip can be delayed by `latency` seconds to simulate network cost in benchmarks.
+"""
+import base64
+import itertools
+import json
+import re
+import time
+import uuid
+from email.parser import Parser
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import httplib2
+from googleapiclient.discovery import build
+
+
+def b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def make_message(
+    ident: str,
+    subject: str = "Test",
+    sender: str = "sender@example.com",
+    to: str = "me@example.com",
+    plain_text: Optional[str] = "Hello",
+    html: Optional[str] = None,
+    attachments: Tuple[Tuple[str, str, bytes], ...] = (),
+    inline_attachments: bool = False,
+    label_ids: Tuple[str, ...] = ("INBOX",),
+) -> Tuple[dict, Dict[str, bytes]]:
+    """
+    Create a Gmail message resource in `format=full` form.
+    Attachments are given as (filename, mime_type, data) tuples. Unless `inline_attachments`
+    is set, their data is only reachable through the attachments endpoint.
+    Returns the message and its attachment data keyed by attachment id.
+    """
+    headers = [
+        {"name": "Subject", "value": subject},
+        {"name": "From", "value": sender},
+        {"name": "To", "value": to},
+        {"name": "Date", "value": "Mon, 19 Jun 2023 10:00:00 +0200"},
+    ]
+    parts = []
+    if plain_text is not None:
+        parts.append({"mimeType": "text/plain", "filename": "", "body": {"data": b64(plain_text.encode())}})
+    if html is not None:
+        parts.append({"mimeType": "text/html", "filename": "", "body": {"data": b64(html.encode())}})
+
+    attachment_data = {}
+    for i, (filename, mime_type, data) in enumerate(attachments):
+        if inline_attachments:
+            body = {"data": b64(data), "size": len(data)}
+        else:
+            att_id = f"{ident}-att-{i}"
+            attachment_data[att_id] = data
+            body = {"attachmentId": att_id, "size": len(data)}
+        parts.append({"mimeType": mime_type, "filename": filename, "body": body})
+
+    if len(parts) == 1 and not attachments:
+        payload = dict(parts[0], headers=headers)
+    else:
+        payload = {"mimeType": "multipart/mixed", "filename": "", "headers": headers, "body": {"size": 0}, "parts": parts}
+
+    message = {"id": ident, "threadId": ident, "labelIds": list(label_ids), "payload": payload}
+    return message, attachment_data
+
+
+class FakeGmailHttp:
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.messages: Dict[str, dict] = {}
+        self.attachments: Dict[str, bytes] = {}
+        self.labels: List[dict] = [{"id": "INBOX", "name": "INBOX", "type": "system"}]
+        self.sent: List[dict] = []
+        # Data received so far by resumable uploads, keyed by upload id.
+        self.uploads: Dict[str, bytearray] = {}
+        # (method, path) of every HTTP round trip, and of every request inside a batch.
+        self.calls: List[Tuple[str, str]] = []
+        self.batched_calls: List[Tuple[str, str]] = []
+        self._ids = itertools.count(1)
+        # Mailbox history records, and the oldest history id Gmail still keeps.
+        self.history: List[dict] = []
+        self.history_id = 1000
+        self.oldest_history_id = 1000
+        # Gmail search queries are not evaluated, tests can set a predicate of (message, query).
+        self.matches: Callable[[dict, str], bool] = lambda message, query: True
+
+    def add_message(self, message: dict, attachments: Optional[Dict[str, bytes]] = None) -> None:
+        self.messages[message["id"]] = message
+        self.attachments.update(attachments or {})
+        self._record("messagesAdded", {"message": _stub(message)})
+
+    def expire_history(self) -> None:
+        self.oldest_history_id = self.history_id + 1
+
+    def _record(self, kind: str, change: dict) -> None:
+        self.history_id += 1
+        self.history.append({"id": str(self.history_id), kind: [change]})
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        path = urlparse(uri).path
+        self.calls.append((method, path))
+        if path == "/batch":
+            return self._batch(body=body, headers=headers)
+        if path.startswith("/upload/"):
+            return self._upload(method=method, uri=uri, body=body, headers=headers)
+        status, content = self._dispatch(method=method, uri=uri, body=body)
+        return _response(status), json.dumps(content).encode()
+
+    def _batch(self, body, headers):
+        mime = Parser().parsestr(f"Content-Type: {headers['content-type']}\r\n\r\n{body}")
+        boundary = uuid.uuid4().hex
+        out = []
+        for part in mime.get_payload():
+            http_request = part.get_payload()
+            request_line, rest = http_request.split("\n", 1)
+            method, uri, _ = request_line.split(" ")
+            request_body = rest.split("\n\n", 1)[1] if "\n\n" in rest else None
+            self.batched_calls.append((method, urlparse(uri).path))
+            status, content = self._dispatch(method=method, uri=uri, body=request_body or None)
+            content_id = "<response-" + part["Content-ID"][1:]
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\n\r\n{json.dumps(content)}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        resp = _response(200, content_type=f"multipart/mixed; boundary={boundary}")
+        return resp, "".join(out).encode()
+
+    def _upload(self, method, uri, body, headers):
+        """Resumable media upload: a POST starts the upload, PUTs send its chunks."""
+        parsed = urlparse(uri)
+        if method == "POST":
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = bytearray()
+            return _response(200, location=f"https://gmail.googleapis.com{parsed.path}?upload_id={upload_id}"), b""
+
+        data = self.uploads[parse_qs(parsed.query)["upload_id"][0]]
+        data += body.read() if hasattr(body, "read") else body
+        headers = {k.lower(): v for k, v in headers.items()}
+        end, total = re.fullmatch(r"bytes \d+-(\d+)/(\d+)", headers["content-range"]).groups()
+        if int(end) + 1 < int(total):
+            return _response(308, range=f"bytes=0-{end}"), b""
+        # Completed uploads are recorded like mails sent with a raw body.
+        route = parsed.path.replace("/upload", "", 1)
+        status, content = self._dispatch(method="POST", uri=route, body=json.dumps({"raw": b64(bytes(data))}))
+        return _response(status), json.dumps(content).encode()
+
+    def _dispatch(self, method: str, uri: str, body) -> Tuple[int, dict]:
+        parsed = urlparse(uri)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        if isinstance(body, bytes):
+            body = body.decode()
+        data = json.loads(body) if body else {}
+        route = parsed.path.replace("/gmail/v1/users/me", "", 1)
+
+        if method == "GET" and route == "/messages":
+            return self._list(query)
+        m = re.fullmatch(r"/messages/([^/]+)/attachments/([^/]+)", route)
+        if method == "GET" and m:
+            if m.group(2) not in self.attachments:
+                return _error(404, "Attachment not found")
+            data = self.attachments[m.group(2)]
+            return 200, {"size": len(data), "data": b64(data)}
+        if method == "POST" and route == "/messages/batchModify":
+            return self._modify(data["ids"], data)
+        m = re.fullmatch(r"/messages/([^/]+)/modify", route)
+        if method == "POST" and m:
+            return self._modify([m.group(1)], data)
+        if method == "POST" and route == "/messages/send":
+            ident = f"sent-{next(self._ids)}"
+            self.sent.append(data)
+            sent = {"id": ident, "threadId": ident, "labelIds": ["SENT"]}
+            self._record("messagesAdded", {"message": sent})
+            return 200, sent
+        m = re.fullmatch(r"/messages/([^/]+)", route)
+        if method == "GET" and m:
+            if m.group(1) not in self.messages:
+                return _error(404, "Requested entity was not found.")
+            return 200, self.messages[m.group(1)]
+        if method == "GET" and route == "/profile":
+            return 200, {"emailAddress": "me@example.com", "historyId": str(self.history_id)}
+        if method == "GET" and route == "/history":
+            return self._list_history(query)
+        if method == "GET" and route == "/labels":
+            return 200, {"labels": self.labels}
+        if method == "POST" and route == "/labels":
+            label = dict(data, id=f"Label_{next(self._ids)}")
+            self.labels.append(label)
+            return 200, label
+        return _error(404, f"No fake route for {method} {route}")
+
+    def _list(self, query: dict) -> Tuple[int, dict]:
+        ids = [i for i, m in self.messages.items() if self.matches(m, query.get("q", ""))]
+        max_results = int(query.get("maxResults", 100))
+        start = int(query.get("pageToken", 0))
+        page = ids[start : start + max_results]
+        result = {"resultSizeEstimate": len(ids)}
+        if page:
+            result["messages"] = [{"id": i, "threadId": i} for i in page]
+        if start + max_results < len(ids):
+            result["nextPageToken"] = str(start + max_results)
+        return 200, result
+
+    def _list_history(self, query: dict) -> Tuple[int, dict]:
+        start = int(query["startHistoryId"])
+        if start < self.oldest_history_id:
+            return _error(404, "Requested entity was not found.")
+        records = [r for r in self.history if int(r["id"]) > start]
+        max_results = int(query.get("maxResults", 100))
+        offset = int(query.get("pageToken", 0))
+        result = {"historyId": str(self.history_id)}
+        if records[offset : offset + max_results]:
+            result["history"] = records[offset : offset + max_results]
+        if offset + max_results < len(records):
+            result["nextPageToken"] = str(offset + max_results)
+        return 200, result
+
+    def _modify(self, ids: List[str], data: dict) -> Tuple[int, dict]:
+        for ident in ids:
+            if ident not in self.messages:
+                return _error(404, "Requested entity was not found.")
+            label_ids = self.messages[ident]["labelIds"]
+            for label_id in data.get("addLabelIds", []):
+                if label_id not in label_ids:
+                    label_ids.append(label_id)
+                    change = {"message": _stub(self.messages[ident]), "labelIds": [label_id]}
+                    self._record("labelsAdded", change)
+            for label_id in data.get("removeLabelIds", []):
+                if label_id in label_ids:
+                    label_ids.remove(label_id)
+                    change = {"message": _stub(self.messages[ident]), "labelIds": [label_id]}
+                    self._record("labelsRemoved", change)
+        return 200, self.messages[ids[0]] if len(ids) == 1 else {}
+
+
+def _stub(message: dict) -> dict:
+    return {"id": message["id"], "threadId": message["threadId"], "labelIds": list(message["labelIds"])}
+
+
+def _response(status: int, content_type: str = "application/json", **headers) -> httplib2.Response:
+    return httplib2.Response(dict(headers, status=str(status), **{"content-type": content_type}))
+
+
+def _error(status: int, message: str) -> Tuple[int, dict]:
+    return status, {"error": {"code": status, "message": message, "errors": [{"message": message}]}}
+
+
+def build_fake_service(http: FakeGmailHttp):
+    return build("gmail", "v1", http=http, static_discovery=True)
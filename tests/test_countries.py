@@ -0,0 +1,44 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from invoicer.countries import CountryTranslator, country_code
+
+
+class TestCountryTranslator(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_file = Path(tmp_dir.name) / "translations.json"
+
+    def test_translates_catalog_names_offline(self):
+        translator = CountryTranslator(cache_file=self.cache_file)
+        with mock.patch("invoicer.countries.GoogleTranslator") as google:
+            self.assertEqual(translator.translate("Österreich"), "Austria")
+            self.assertEqual(translator.translate("Vereinigtes Königreich"), "United Kingdom")
+        google.assert_not_called()
+        self.assertEqual(country_code("Österreich"), "AT")
+
+    def test_unknown_names_use_cache_file(self):
+        self.cache_file.write_text(json.dumps({"Tschechische Republik": "Czech Republic"}))
+        translator = CountryTranslator(cache_file=self.cache_file)
+        self.assertEqual(translator.translate("Tschechische Republik"), "Czech Republic")
+
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(translator.translate("Atlantis"), "Atlantis")
+
+    def test_online_fallback_fills_cache_file(self):
+        translator = CountryTranslator(cache_file=self.cache_file, online_fallback=True)
+        with mock.patch("invoicer.countries.GoogleTranslator") as google:
+            google.return_value.translate.return_value = "Atlantis Republic"
+            self.assertEqual(translator.translate("Atlantis"), "Atlantis Republic")
+            self.assertEqual(translator.translate("Atlantis"), "Atlantis Republic")
+
+        google.return_value.translate.assert_called_once_with("Atlantis")
+        self.assertEqual(json.loads(self.cache_file.read_text()), {"Atlantis": "Atlantis Republic"})
+
+
+if __name__ == "__main__":
+    unittest.main()
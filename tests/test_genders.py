@@ -0,0 +1,39 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import gender_guesser.detector as gender
+
+from invoicer.genders import GenderGuesser
+
+
+class TestGenderGuesser(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_file = Path(tmp_dir.name) / "names.pickle"
+
+    def test_guesses_like_detector(self):
+        guesser = GenderGuesser()
+        self.assertEqual(guesser.guess("Max", "germany"), "male")
+        self.assertEqual(guesser.guess("Anna", "01234 berlin"), "female")
+
+    def test_repeated_guesses_are_memoized(self):
+        guesser = GenderGuesser()
+        with mock.patch.object(gender.Detector, "get_gender", return_value="male") as get_gender:
+            guesser.guess("Max", "germany")
+            guesser.guess("Max", "germany")
+        get_gender.assert_called_once()
+
+    def test_cold_start_loads_cached_names(self):
+        GenderGuesser(cache_file=self.cache_file).guess("Max")
+        self.assertTrue(self.cache_file.exists())
+
+        with mock.patch.object(gender.Detector, "_parse") as parse:
+            self.assertEqual(GenderGuesser(cache_file=self.cache_file).guess("Max", "germany"), "male")
+        parse.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,339 @@
+import base64
+import email
+import json
+import os
+import tempfile
+import threading
+import unittest
+from email import policy
+from pathlib import Path
+from unittest import mock
+
+from googleapiclient.errors import HttpError
+
+from invoicer.config import Config, GmailCfg, InvoiceMailCfg, OrderMailCfg
+from invoicer.mail import Attachment, Mail, SpilledText
+from invoicer.mail_account import INVOICED_LABEL, GmailAccount, IncrementalSearch, InvoicerAccount
+from tests.fake_gmail import FakeGmailHttp, build_fake_service, make_message
+from tests.test_order_mail_parser import MAIL_BODY, MAIL_SUBJECT
+
+
+class TestGmailAccount(unittest.TestCase):
+    def setUp(self) -> None:
+        self.http = FakeGmailHttp()
+        for i in range(7):
+            self.http.add_message(*make_message(ident=f"m{i}", subject=f"Order {i}"))
+        self.account = GmailAccount.from_service(build_fake_service(self.http), batch_size=3)
+
+    def test_get_mails_batches_requests(self):
+        msg_ids = [f"m{i}" for i in range(7)]
+        mails, failures = self.account._get_mails(msg_ids=msg_ids)
+
+        self.assertEqual([m["id"] for m in mails], msg_ids)
+        self.assertEqual(failures, {})
+        self.assertEqual(self.http.calls, [("POST", "/batch")] * 3)
+        self.assertEqual(len(self.http.batched_calls), 7)
+
+    def test_iter_mails_fetches_one_batch_at_a_time(self):
+        mails = self.account.iter_mails(query="")
+        self.assertEqual(next(mails).mail.ident, "m0")
+        self.assertEqual(self.http.calls.count(("POST", "/batch")), 1)
+
+        self.assertEqual([m.mail.ident for m in mails], [f"m{i}" for i in range(1, 7)])
+        self.assertEqual(self.http.calls.count(("POST", "/batch")), 3)
+
+    def test_get_mails_captures_item_errors(self):
+        mails, failures = self.account._get_mails(msg_ids=["m0", "missing", "m1"])
+
+        self.assertEqual([m["id"] for m in mails], ["m0", "m1"])
+        self.assertEqual(list(failures), ["missing"])
+        self.assertEqual(failures["missing"].resp.status, 404)
+
+    def test_list_mail_ids_follows_pages(self):
+        account = GmailAccount.from_service(build_fake_service(self.http), page_size=2)
+        msg_ids = list(account._list_mail_ids(query=""))
+
+        self.assertEqual(msg_ids, [f"m{i}" for i in range(7)])
+        self.assertEqual(len(self.http.calls), 4)
+
+    def test_list_mail_ids_is_capped(self):
+        account = GmailAccount.from_service(build_fake_service(self.http), page_size=2, max_results=3)
+        with self.assertLogs(level="WARNING"):
+            msg_ids = list(account._list_mail_ids(query=""))
+
+        self.assertEqual(msg_ids, ["m0", "m1", "m2"])
+
+    def test_list_mail_ids_of_empty_search(self):
+        http = FakeGmailHttp()
+        account = GmailAccount.from_service(build_fake_service(http))
+        self.assertEqual(list(account._list_mail_ids(query="")), [])
+
+    def test_get_mail_fetches_each_attachment_once(self):
+        attachments = tuple((f"photo{i}.jpg", "image/jpeg", f"data{i}".encode()) for i in range(5))
+        message, data = make_message(ident="a0", attachments=attachments)
+        self.http.add_message(message, data)
+
+        self.http.calls.clear()
+        parsed_mail = self.account._get_mail(message)
+        self.addCleanup(lambda: [p.unlink() for p in parsed_mail.mail.attachments])
+
+        self.assertEqual(len(self.http.calls), 5)
+        self.assertTrue(all("/attachments/" in path for _, path in self.http.calls))
+        self.assertEqual([p.read_bytes() for p in parsed_mail.mail.attachments], [a[2] for a in attachments])
+
+    def test_get_mail_decodes_inline_attachments(self):
+        attachments = (("scan.pdf", "application/pdf", b"%PDF"), ("scan.pdf", "application/pdf", b"%PDF-2"))
+        message, _ = make_message(ident="a1", attachments=attachments, inline_attachments=True)
+
+        self.http.calls.clear()
+        parsed_mail = self.account._get_mail(message)
+        self.addCleanup(lambda: [p.unlink() for p in parsed_mail.mail.attachments])
+
+        self.assertEqual(self.http.calls, [])
+        self.assertEqual([p.read_bytes() for p in parsed_mail.mail.attachments], [b"%PDF", b"%PDF-2"])
+        self.assertEqual(len(set(parsed_mail.mail.attachments)), 2)
+
+    def test_send_mail_uploads_attachments_in_chunks(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        invoice = Path(tmp_dir.name) / "Invoice-2023001.docx"
+        invoice.write_bytes(bytes(range(256)) * 4000)
+        scan = Path(tmp_dir.name) / "Scan ü.unknown"
+        scan.write_bytes(b"")
+        # Plain ASCII bodies are sent as 7bit text, which does not end with a line break.
+        mail = Mail(sender="me", to="seller@example.com", subject="Rechnung für #1", html="<p>Gruss</p>")
+        mail.attachments += [invoice, scan]
+
+        self.http.calls.clear()
+        with mock.patch("invoicer.mail_account.UPLOAD_CHUNK_SIZE", 256 * 1024):
+            ident = self.account.send_mail(mail=mail, delete_attachments=True)
+
+        self.assertIsNotNone(ident)
+        self.assertEqual(self.http.calls.count(("POST", "/upload/gmail/v1/users/me/messages/send")), 1)
+        self.assertEqual(sum(method == "PUT" for method, _ in self.http.calls), 6)
+        self.assertFalse(invoice.exists() or scan.exists())
+
+        message = email.message_from_bytes(base64.urlsafe_b64decode(self.http.sent[-1]["raw"]), policy=policy.default)
+        self.assertEqual((message["To"], message["Subject"]), ("seller@example.com", "Rechnung für #1"))
+        body, *attachments = message.iter_parts()
+        self.assertEqual(body.get_content(), "<p>Gruss</p>")
+        self.assertEqual([a.get_filename() for a in attachments], ["Invoice-2023001.docx", "Scan ü.unknown"])
+        self.assertEqual(attachments[0].get_content(), bytes(range(256)) * 4000)
+        self.assertEqual((attachments[1].get_content_type(), attachments[1].get_content()), ("application/octet-stream", b""))
+
+    def test_send_mail_attaches_from_memory(self):
+        mail = Mail(sender="me", to="seller@example.com", subject="Rechnung", html="<p>Hallo</p>")
+        mail.attachments.append(Attachment(filename="Invoice-2023001.docx", data=b"docx" * 100_000))
+
+        self.assertIsNotNone(self.account.send_mail(mail=mail, delete_attachments=True))
+        message = email.message_from_bytes(base64.urlsafe_b64decode(self.http.sent[-1]["raw"]), policy=policy.default)
+        _, attachment = message.iter_parts()
+        self.assertEqual(attachment.get_filename(), "Invoice-2023001.docx")
+        self.assertEqual(attachment.get_content(), b"docx" * 100_000)
+
+    def test_batch_size_is_bounded(self):
+        with self.assertRaises(ValueError):
+            GmailAccount.from_service(build_fake_service(self.http), batch_size=101)
+
+
+class TestInvoicerAccountLabels(unittest.TestCase):
+    def setUp(self) -> None:
+        self.http = FakeGmailHttp()
+        for i in range(3):
+            self.http.add_message(*make_message(ident=f"m{i}"))
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cfg = Config(
+            orderMail=OrderMailCfg(subjectHas="Neue Bestellung", sender="shop@example.com"),
+            invoiceMail=InvoiceMailCfg(to="seller@example.com", saluteName="Max"),
+            invoiceCountStart=0,
+            pollInterval=60,
+            gmail=GmailCfg(
+                incrementalSync=False,
+                labelJournalFile=str(Path(tmp_dir.name) / "labels.sqlite3"),
+                labelCacheFile=str(Path(tmp_dir.name) / "label_ids.json"),
+            ),
+            processedMailsFile=str(Path(tmp_dir.name) / "processed.sqlite3"),
+        )
+        self.account = self._account()
+
+    def _account(self):
+        return InvoicerAccount.from_mailing(self.cfg, GmailAccount.from_service(build_fake_service(self.http)))
+
+    def _label(self, mail_id):
+        self.account.label_journal.add(mail_id=mail_id, label=INVOICED_LABEL)
+
+    def _label_id(self, name):
+        return next(label["id"] for label in self.http.labels if label["name"] == name)
+
+    def test_labels_are_resolved_once(self):
+        self.assertEqual(self.http.calls, [])
+        for i in range(3):
+            self._label(f"m{i}")
+        self.account.flush_labels()
+        self.assertEqual(
+            self.http.calls,
+            [
+                ("GET", "/gmail/v1/users/me/labels"),
+                ("POST", "/gmail/v1/users/me/labels"),
+                ("POST", "/gmail/v1/users/me/messages/batchModify"),
+            ],
+        )
+        for i in range(3):
+            self.assertIn(self._label_id(INVOICED_LABEL), self.http.messages[f"m{i}"]["labelIds"])
+        self.assertEqual(self.account.label_journal.pending(), {})
+        self.assertEqual(self.account.processed.stages(["m0"]), {"m0": "labelled"})
+
+        self.http.calls.clear()
+        self.account = self._account()
+        self._label("m0")
+        self.account.flush_labels()
+        self.assertEqual(self.http.calls, [("POST", "/gmail/v1/users/me/messages/batchModify")])
+
+    def test_deleted_label_is_created_again(self):
+        self._label("m0")
+        self.account.flush_labels()
+        self.http.labels = [label for label in self.http.labels if label["name"] != INVOICED_LABEL]
+        self._label("m1")
+
+        self.account = self._account()
+        with mock.patch.object(self.account._mailing, "add_labels", side_effect=HttpError(mock.Mock(status=400), b"")):
+            with self.assertLogs(level="ERROR"):
+                self.account.flush_labels()
+        self.account.flush_labels()
+        self.assertIn(self._label_id(INVOICED_LABEL), self.http.messages["m1"]["labelIds"])
+
+    def test_flush_labels_in_chunks(self):
+        with mock.patch("invoicer.mail_account.MAX_BATCH_MODIFY", 2):
+            for i in range(3):
+                self._label(f"m{i}")
+            self.account.flush_labels()
+        self.assertEqual(self.http.calls[-2:], [("POST", "/gmail/v1/users/me/messages/batchModify")] * 2)
+        self.assertEqual(self.account.label_journal.pending(), {})
+
+    def test_failed_flush_keeps_labels(self):
+        self._label("m0")
+        self._label("missing")
+        with self.assertLogs(level="ERROR"):
+            self.account.flush_labels()
+        self.assertEqual(self.account.label_journal.pending(), {INVOICED_LABEL: ["m0", "missing"]})
+
+    def test_pending_mails_are_not_searched_again(self):
+        self._label("m0")
+        with mock.patch.object(self.account._mailing, "add_labels", side_effect=HttpError(mock.Mock(status=500), b"")):
+            with self.assertLogs(level="ERROR"):
+                mails = self.account.search_new_customer_mails()
+        self.assertEqual([m.mail.ident for m in mails], ["m1", "m2"])
+
+    def test_orders_are_parsed_and_spilled_while_searching(self):
+        self.http = FakeGmailHttp()
+        for i in range(4):
+            self.http.add_message(*make_message(ident=f"o{i}", subject=MAIL_SUBJECT, plain_text=MAIL_BODY))
+        self.account = InvoicerAccount.from_mailing(
+            self.cfg, GmailAccount.from_service(build_fake_service(self.http), batch_size=2)
+        )
+
+        orders = self.account.search_new_orders()
+        first = next(orders)
+        self.assertEqual(self.http.calls.count(("POST", "/batch")), 1)
+        self.assertIsInstance(first.source_mail._plain_text, SpilledText)
+        self.assertEqual(first.source_mail.plain_text, MAIL_BODY)
+
+        self.assertEqual([order.source_mail.ident for order in orders], ["o1", "o2", "o3"])
+        self.assertEqual(set(self.account.processed.stages(["o0", "o3"]).values()), {"parsed"})
+
+    def test_add_labels_is_bounded(self):
+        with self.assertRaises(ValueError):
+            self.account._mailing.add_labels(mail_ids=[str(i) for i in range(1001)], label_id="Invoiced")
+
+
+class TestIncrementalSearch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.http = FakeGmailHttp()
+        self.http.matches = lambda message, query: "Invoiced" not in message["labelIds"]
+        self.http.add_message(*make_message(ident="m0"))
+        self.account = GmailAccount.from_service(build_fake_service(self.http))
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.search = IncrementalSearch(
+            mailing=self.account, query="-label:Invoiced", name="orders", history_file=Path(self.tmp_dir.name) / "history.json"
+        )
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _searched(self):
+        return ("GET", "/gmail/v1/users/me/messages") in self.http.calls
+
+    def _invoice(self, msg_id):
+        self.http.messages[msg_id]["labelIds"].append("Invoiced")
+
+    def test_quiet_mailbox_is_not_searched(self):
+        self.assertEqual(len(self.search.search()), 1)
+        self._invoice("m0")
+        self.assertEqual(len(self.search.search()), 0)
+
+        self.http.calls.clear()
+        self.assertEqual(self.search.search(), ())
+        self.assertFalse(self._searched())
+        self.assertEqual(len(self.http.calls), 1)
+
+    def test_own_sent_mails_are_ignored(self):
+        self._invoice("m0")
+        self.search.search()
+        self.account.service.users().messages().send(userId="me", body={"raw": ""}).execute()
+
+        self.http.calls.clear()
+        self.search.search()
+        self.assertFalse(self._searched())
+
+    def test_new_mail_triggers_search(self):
+        self._invoice("m0")
+        self.search.search()
+        self.http.add_message(*make_message(ident="m1"))
+
+        mails = self.search.search()
+        self.assertEqual([m.mail.ident for m in mails], ["m1"])
+
+    def test_mail_moved_into_inbox_triggers_search(self):
+        self.http.messages["m0"]["labelIds"] = ["Invoiced"]
+        self.search.search()
+        self.account.add_labels(["m0"], label_id="STARRED")
+
+        self.http.calls.clear()
+        self.search.search()
+        self.assertFalse(self._searched())
+
+        self.account.add_labels(["m0"], label_id="INBOX")
+        self.search.search()
+        self.assertTrue(self._searched())
+
+    def test_expired_history_falls_back_to_full_search(self):
+        self._invoice("m0")
+        self.search.search()
+        self.http.expire_history()
+
+        self.http.calls.clear()
+        with self.assertLogs(level="WARNING"):
+            self.search.search()
+        self.assertTrue(self._searched())
+
+    def test_searches_sharing_history_file_save_concurrently(self):
+        history_file = Path(self.tmp_dir.name) / "history.json"
+        searches = [IncrementalSearch(mailing=self.account, query="", name=name, history_file=history_file) for name in "ab"]
+
+        def save(search):
+            for i in range(200):
+                search._save(str(i))
+
+        threads = [threading.Thread(target=save, args=(search,)) for search in searches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(json.loads(history_file.read_text()), {"a": "199", "b": "199"})
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["history.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from docx import Document
+
+from invoicer.config import Config, InvoiceMailCfg, OrderMailCfg, PdfCfg
+from invoicer.invoice import (
+    ITEM_COLUMN_ALIGNMENTS,
+    TABLE_FONT,
+    InvoiceGenerator,
+    InvoiceTemplate,
+    _index_placeholders,
+    _replace_item_table,
+    _replace_span,
+)
+from invoicer.mail import Mail
+from invoicer.order import Item
+from invoicer.order_mail_parsers import order_from_mail
+from invoicer.utils import eur
+from tests.test_order_mail_parser import MAIL_BODY, MAIL_SUBJECT
+from tests.test_pdf import fake_soffice
+
+
+TEMPLATE = Path(__file__).parents[1] / "docs" / "template_sample.docx"
+
+
+class TestInvoiceTemplate(unittest.TestCase):
+    def test_index_finds_placeholders_of_sample(self):
+        template = InvoiceTemplate(TEMPLATE)
+        self.assertEqual(
+            set(template.spans),
+            {"{{address}}", "{{date}}", "{{invoice_nr}}", "{{salutation}}", "{{payment_method}}", "{{7_s_e}}", "{{19_s_e}}"},
+        )
+
+    def test_new_document_is_independent_copy(self):
+        template = InvoiceTemplate(TEMPLATE)
+        document = template.new_document()
+        document.paragraphs[0].text = "changed"
+        self.assertNotEqual(template.new_document().paragraphs[0].text, "changed")
+
+    def test_changes_of_new_document_are_saved(self):
+        document = InvoiceTemplate(TEMPLATE).new_document()
+        document.paragraphs[0].text = "changed"
+        buffer = io.BytesIO()
+        document.save(buffer)
+        self.assertEqual(Document(buffer).paragraphs[0].text, "changed")
+
+    def test_replace_spans_across_runs(self):
+        document = Document()
+        paragraph = document.add_paragraph()
+        for text in ("Hi {{na", "me}}, ", "", "{{x}}{{y}}", "!"):
+            paragraph.add_run(text)
+
+        spans = _index_placeholders(document.paragraphs)
+        replacements = {"{{name}}": "Max", "{{x}}": "1", "{{y}}": "22"}
+        for token, span in sorted(((t, s) for t, spans in spans.items() for s in spans), key=lambda e: e[1], reverse=True):
+            _replace_span(runs=document.paragraphs[0].runs, span=span, new=replacements[token])
+
+        self.assertEqual(document.paragraphs[0].text, "Hi Max, 122!")
+
+    def test_fill_replaces_placeholders_everywhere(self):
+        document = Document()
+        document.add_paragraph("Invoice {{invoice_nr}} of {{date}}")
+        cell = document.add_table(rows=1, cols=1).cell(0, 0)
+        cell.text = "{{date}}"
+        cell.add_table(rows=1, cols=1).cell(0, 0).text = "{{payment_method}}"
+        document.sections[0].header.paragraphs[0].text = "Nr. {{invoice_nr}}"
+        document.sections[0].footer.paragraphs[0].text = "{{unknown}}"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "template.docx"
+            document.save(path)
+            template = InvoiceTemplate(path)
+
+        invoice = template.new_document()
+        with self.assertLogs(level="WARNING"):
+            report = template.fill(
+                invoice, {"{{invoice_nr}}": "2023001", "{{date}}": "19.06.2023", "{{payment_method}}": None, "{{x}}": "1"}
+            )
+
+        self.assertEqual(report, (["{{unknown}}"], ["{{payment_method}}"]))
+        self.assertEqual(invoice.paragraphs[0].text, "Invoice 2023001 of 19.06.2023")
+        cell = invoice.tables[0].cell(0, 0)
+        self.assertEqual(cell.paragraphs[0].text, "19.06.2023")
+        self.assertEqual(cell.tables[0].cell(0, 0).text, "{{payment_method}}")
+        self.assertEqual(invoice.sections[0].header.paragraphs[0].text, "Nr. 2023001")
+        self.assertEqual(invoice.sections[0].footer.paragraphs[0].text, "{{unknown}}")
+
+    def test_item_rows_are_styled_copies(self):
+        table = InvoiceTemplate(TEMPLATE).new_document().tables[0]
+        header_rows = len(table.rows)
+        items = [Item(count=2, description="Mug", price=10.0), Item(count=1, description="Cup\nwhite", price=5.0)]
+        _replace_item_table(t=table, items=items, font=TABLE_FONT)
+
+        rows = table.rows[header_rows:]
+        self.assertEqual([cell.text for cell in rows[1].cells][:4], ["2", "1", "Stck.", "Cup\nwhite"])
+        self.assertEqual(rows[0].cells[6].text, eur(items[0].total_price_gross))
+        for row in rows:
+            for cell, alignment in zip(row.cells, ITEM_COLUMN_ALIGNMENTS):
+                self.assertEqual(cell.paragraphs[0].alignment, alignment)
+                self.assertEqual(cell.paragraphs[0].runs[0].font.name, TABLE_FONT.name)
+
+
+def _order(ident: str = "m0"):
+    mail = Mail(
+        sender="shop@example.com",
+        to="me@example.com",
+        subject=MAIL_SUBJECT,
+        plain_text=MAIL_BODY,
+        date="Mon, 19 Jun 2023 10:00:00 +0200",
+        ident=ident,
+    )
+    return order_from_mail(mail)
+
+
+class TestInvoiceGenerator(unittest.TestCase):
+    def setUp(self) -> None:
+        cwd = os.getcwd()
+        tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(tmp_dir.name)
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, cwd)
+
+        self.cfg = Config(
+            orderMail=OrderMailCfg(subjectHas="Neue Bestellung", sender="shop@example.com"),
+            invoiceMail=InvoiceMailCfg(to="seller@example.com", saluteName="Max"),
+            invoiceCountStart=0,
+            pollInterval=60,
+        )
+        self.generator = InvoiceGenerator(cfg=self.cfg, template_path=TEMPLATE)
+
+    def test_generate_renders_in_memory(self):
+        order = _order()
+        invoice, errors = self.generator.generate(order)
+
+        self.assertIs(invoice, order.invoice)
+        self.assertEqual(errors, [])
+        document = Document(io.BytesIO(invoice.docx))
+        self.assertIn("2023001", "\n".join(p.text for p in document.paragraphs))
+        self.assertNotIn("{{", "\n".join(cell.text for table in document.tables for row in table.rows for cell in row.cells))
+        self.assertEqual(os.listdir(), [".invoice_numbers.sqlite3"])
+
+    def test_generate_keeps_archive_copy(self):
+        self.cfg.invoiceArchiveDir = "archive/2023"
+        generator = InvoiceGenerator(cfg=self.cfg, template_path=TEMPLATE)
+        invoice, _ = generator.generate(_order())
+
+        self.assertEqual(Path("archive/2023/Invoice-2023001.docx").read_bytes(), invoice.docx)
+
+    def test_generate_many_numbers_in_order_and_reports_failures(self):
+        orders = [_order(ident=f"m{i}") for i in range(4)]
+        orders[1].date = None
+        orders[2].invoice.address.address = "Nowhere"
+
+        with self.assertLogs(level="ERROR"):
+            results = self.generator.generate_many(orders, workers=2)
+
+        self.assertEqual([r.succeeded for r in results], [True, False, False, True])
+        self.assertEqual([o.invoice.number for o in orders], ["2023001", None, "2023002", "2023003"])
+        self.assertIs(results[0].invoice, orders[0].invoice)
+        self.assertEqual(Document(io.BytesIO(orders[3].invoice.docx)).tables[0].rows[1].cells[0].text, "1")
+
+    def test_generate_many_skips_numbered_orders(self):
+        orders = [_order(ident=f"m{i}") for i in range(3)]
+        orders[1].invoice.number = "2023900"
+
+        self.generator.generate_many(orders, workers=1)
+
+        self.assertEqual([o.invoice.number for o in orders], ["2023001", "2023900", "2023002"])
+        self.assertIsNone(self.generator.invoice_numbers.find("mail:m1"))
+
+    def test_generate_many_adds_pdfs(self):
+        os.mkdir("bin")
+        self.cfg.pdf = PdfCfg(enabled=True, soffice=str(fake_soffice(Path("bin").absolute())))
+        self.cfg.invoiceArchiveDir = "archive"
+        os.mkdir("archive")
+        generator = InvoiceGenerator(cfg=self.cfg, template_path=TEMPLATE)
+        orders = [_order(ident=f"m{i}") for i in range(2)]
+
+        results = generator.generate_many(orders, workers=1)
+
+        self.assertEqual([r.errors for r in results], [[], []])
+        self.assertEqual([o.invoice.pdf for o in orders], [b"%PDF-" + o.invoice.docx for o in orders])
+        self.assertEqual(Path("archive/Invoice-2023002.pdf").read_bytes(), orders[1].invoice.pdf)
+        self.assertEqual(len(Path("bin/calls.log").read_text().splitlines()), 1)
+
+    def test_add_pdfs_reports_failures_per_invoice(self):
+        os.mkdir("bin")
+        self.cfg.pdf = PdfCfg(enabled=True, soffice=str(fake_soffice(Path("bin").absolute())))
+        self.cfg.invoiceArchiveDir = "archive"
+        generator = InvoiceGenerator(cfg=self.cfg, template_path=TEMPLATE)
+        invoices = [SimpleNamespace(number=str(i), docx=docx, pdf=None) for i, docx in enumerate((b"a", b"broken", b"c"))]
+        # The PDF of the last invoice cannot be archived.
+        os.mkdir("archive/Invoice-2.pdf")
+
+        with self.assertLogs(level="ERROR"):
+            converted = generator.add_pdfs(invoices)
+
+        self.assertEqual(converted, [True, False, False])
+        self.assertEqual([invoice.pdf for invoice in invoices], [b"%PDF-a", None, b"%PDF-c"])
+        self.assertEqual(Path("archive/Invoice-0.pdf").read_bytes(), b"%PDF-a")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from invoicer.labels import LabelIds, LabelJournal
+from invoicer.mail_account import GmailAccount
+from tests.fake_gmail import FakeGmailHttp, build_fake_service
+
+
+class TestLabelJournal(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = Path(tmp_dir.name) / "labels.sqlite3"
+        self.journal = LabelJournal(self.path)
+
+    def test_pending_per_label_in_order(self):
+        self.journal.add("m1", "Invoiced")
+        self.journal.add("m0", "Forwarded")
+        self.journal.add("m2", "Invoiced")
+        self.journal.add("m1", "Invoiced")
+
+        self.assertEqual(self.journal.pending(), {"Invoiced": ["m1", "m2"], "Forwarded": ["m0"]})
+        self.assertEqual(self.journal.pending_mail_ids(), {"m0", "m1", "m2"})
+
+    def test_remove(self):
+        self.journal.add("m0", "Invoiced")
+        self.journal.add("m1", "Invoiced")
+        self.journal.remove("Invoiced", ["m0"])
+
+        self.assertEqual(self.journal.pending(), {"Invoiced": ["m1"]})
+
+    def test_survives_restart(self):
+        self.journal.add("m0", "Invoiced")
+
+        self.assertEqual(LabelJournal(self.path).pending(), {"Invoiced": ["m0"]})
+
+
+class TestLabelIds(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_file = Path(tmp_dir.name) / "label_ids.json"
+        self.http = FakeGmailHttp()
+        self.http.labels.append({"id": "Label_9", "name": "Invoiced"})
+        self.mailing = GmailAccount.from_service(build_fake_service(self.http))
+
+    def test_labels_are_listed_once(self):
+        label_ids = LabelIds(mailing=self.mailing, cache_file=self.cache_file)
+        self.assertEqual(label_ids.get("Invoiced"), "Label_9")
+        forwarded_id = label_ids.get("Forwarded")
+        self.assertEqual(label_ids.get("Forwarded"), forwarded_id)
+        self.assertEqual([call[0] for call in self.http.calls], ["GET", "POST"])
+
+        self.http.calls.clear()
+        self.assertEqual(LabelIds(mailing=self.mailing, cache_file=self.cache_file).get("Forwarded"), forwarded_id)
+        self.assertEqual(self.http.calls, [])
+
+    def test_invalid_cache_is_ignored(self):
+        self.cache_file.write_text('{"Invoiced": 9}')
+        label_ids = LabelIds(mailing=self.mailing, cache_file=self.cache_file)
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(label_ids.get("Invoiced"), "Label_9")
+
+    def test_concurrent_lookups_create_label_once(self):
+        class SlowMailing:
+            inserted = []
+
+            def get_labels(self):
+                time.sleep(0.05)
+                return []
+
+            def insert_label(self, name):
+                time.sleep(0.05)
+                self.inserted.append(name)
+                return f"Label_{len(self.inserted)}"
+
+        mailing = SlowMailing()
+        label_ids = LabelIds(mailing=mailing, cache_file=self.cache_file)
+        ids = []
+        threads = [threading.Thread(target=lambda: ids.append(label_ids.get("Forwarded"))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(mailing.inserted, ["Forwarded"])
+        self.assertEqual(ids, ["Label_1"] * 4)
+        self.assertEqual(sorted(p.name for p in self.cache_file.parent.iterdir()), ["label_ids.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
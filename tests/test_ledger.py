@@ -0,0 +1,26 @@
+import unittest
+
+from invoicer.ledger import TaxLedger, TaxTotals
+from invoicer.order import Item
+
+
+class TestTaxLedger(unittest.TestCase):
+    def test_lines_are_rounded_to_whole_cents(self):
+        item = Item(count=3, description="Mug", price=10.0)
+
+        self.assertEqual((item.gross_cents, item.net_cents, item.tax_cents), (1000, 935, 65))
+        self.assertEqual(str(item.total_price_net), "9.35")
+
+    def test_totals_per_rate_are_exact(self):
+        items = [Item(count=1, description="Seeds", price=0.1) for _ in range(1000)]
+        items.append(Item(count=1, description="Shipping", price=4.9, tax_rate=0.19))
+        ledger = TaxLedger.from_items(items)
+
+        # 0.10 € gross is 0.09 € net after rounding, so 1000 lines make 90 € net, not 93.46 €.
+        self.assertEqual(ledger.totals(), {0.07: TaxTotals(9000, 1000, 10000), 0.19: TaxTotals(412, 78, 490)})
+        self.assertEqual(ledger.total(), TaxTotals(9412, 1078, 10490))
+        self.assertEqual(len(ledger), 1001)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import pickle
+import unittest
+
+from invoicer.mail import Base64Text, Mail, SpilledText, TextSpool, iter_parts, payload_to_mail
+from tests.fake_gmail import b64
+
+
+HEADERS = [
+    {"name": "Subject", "value": "Frage"},
+    {"name": "From", "value": "Max Mustermann <max@example.com>"},
+    {"name": "To", "value": "me@example.com"},
+    {"name": "Date", "value": "Mon, 19 Jun 2023 10:00:00 +0200"},
+]
+
+
+def _text(mime_type, text, charset="utf-8"):
+    headers = [{"name": "Content-Type", "value": f'{mime_type}; charset="{charset}"'}]
+    return {"mimeType": mime_type, "filename": "", "headers": headers, "body": {"data": b64(text.encode(charset))}}
+
+
+def _multipart(mime_type, *parts, **kwargs):
+    return dict({"mimeType": mime_type, "filename": "", "body": {"size": 0}, "parts": list(parts)}, **kwargs)
+
+
+class TestPayloadToMail(unittest.TestCase):
+    def test_nested_multiparts(self):
+        image = {"mimeType": "image/png", "filename": "photo.png", "body": {"attachmentId": "att-1", "size": 20_000_000}}
+        document = {"mimeType": "application/msword", "filename": "list.doc", "body": {"data": b64(b"doc"), "size": 3}}
+        payload = _multipart(
+            "multipart/mixed",
+            _multipart(
+                "multipart/related",
+                _multipart("multipart/alternative", _text("text/plain", "Hallo"), _text("text/html", "<p>Hallo</p>")),
+                {"mimeType": "image/gif", "filename": "", "body": {"attachmentId": "att-0", "size": 10}},
+            ),
+            image,
+            document,
+            _text("text/plain", "Weitergeleitet"),
+            headers=HEADERS,
+        )
+
+        mail, attachments, errors = payload_to_mail(payload, ident="1")
+        self.assertEqual(errors, [])
+        self.assertEqual((mail.sender, mail.to, mail.subject), ("max@example.com", "me@example.com", "Frage"))
+        self.assertEqual(mail.plain_text, "Hallo")
+        self.assertEqual(mail.html, "<p>Hallo</p>")
+        self.assertEqual([(a.ident, a.filename, a.data) for a in attachments], [
+            ("att-0", "attachment", None),
+            ("att-1", "photo.png", None),
+            (None, "list.doc", b64(b"doc")),
+        ])
+
+    def test_single_part_and_unexpected_parts(self):
+        mail, attachments, errors = payload_to_mail(dict(_text("text/html", "<p>Hallo</p>"), headers=HEADERS), ident="1")
+        self.assertEqual((mail.plain_text, mail.html, attachments, errors), (None, "<p>Hallo</p>", [], []))
+
+        payload = _multipart("multipart/mixed", _text("text/plain", "Hallo"), {"mimeType": "text/calendar", "body": {}}, headers=HEADERS)
+        _, _, errors = payload_to_mail(payload, ident="1")
+        self.assertEqual(errors, ["Unexpected mimeType: text/calendar"])
+
+    def test_bodies_are_decoded_on_access(self):
+        payload = _multipart("multipart/alternative", _text("text/plain", "Grüße", charset="iso-8859-1"), headers=HEADERS)
+        mail, _, _ = payload_to_mail(payload, ident="1")
+        self.assertIsInstance(mail._plain_text, Base64Text)
+        self.assertEqual(mail.plain_text, "Grüße")
+        self.assertEqual(mail._plain_text, "Grüße")
+        self.assertEqual(pickle.loads(pickle.dumps(mail)), mail)
+
+    def test_deeply_nested_payload(self):
+        payload = _text("text/plain", "Hallo")
+        for _ in range(5000):
+            payload = _multipart("multipart/mixed", payload)
+        self.assertEqual([part["mimeType"] for part in iter_parts(payload)], ["text/plain"])
+
+
+class TestMail(unittest.TestCase):
+    def test_text_fields(self):
+        mail = Mail(sender="a", to="b", subject="c", plain_text="Hallo")
+        self.assertEqual((mail.plain_text, mail.html), ("Hallo", None))
+        mail.html = "<p>Hallo</p>"
+        self.assertEqual(mail, Mail(sender="a", to="b", subject="c", plain_text="Hallo", html="<p>Hallo</p>"))
+
+    def test_spill_body(self):
+        spool = TextSpool()
+        mails = [Mail(sender="a", to="b", subject="c", plain_text=f"Grüße {i}", html=None) for i in range(3)]
+        for mail in mails:
+            mail.spill_body(spool)
+        self.assertIsInstance(mails[1]._plain_text, SpilledText)
+        self.assertIsNone(mails[1]._html)
+        self.assertEqual([mail.plain_text for mail in mails], ["Grüße 0", "Grüße 1", "Grüße 2"])
+        # Text is read back on each access, not kept.
+        self.assertIsInstance(mails[1]._plain_text, SpilledText)
+        copy = pickle.loads(pickle.dumps(mails[2]))
+        self.assertEqual(copy._plain_text, "Grüße 2")
+        self.assertEqual(copy, mails[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
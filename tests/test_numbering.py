@@ -0,0 +1,63 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from invoicer.numbering import InvoiceNumberAllocator
+
+
+class TestInvoiceNumberAllocator(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dir = Path(tmp_dir.name)
+        self.allocator = self._allocator()
+
+    def _allocator(self):
+        return InvoiceNumberAllocator(
+            path=self.dir / "numbers.sqlite3", start_count=41, legacy_count_file=self.dir / ".last_invoice_count"
+        )
+
+    def test_sequences_per_year(self):
+        self.assertEqual(self.allocator.reserve(2023, "a"), "2023042")
+        self.assertEqual(self.allocator.reserve(2023, "b"), "2023043")
+        self.assertEqual(self.allocator.reserve(2024, "c"), "2024001")
+        self.assertEqual(self.allocator.reserve(2023, "d"), "2023044")
+
+    def test_order_keeps_its_number_across_restarts(self):
+        self.allocator.reserve(2023, "a")
+        number = self.allocator.reserve(2023, "b")
+
+        restarted = self._allocator()
+        self.assertEqual(restarted.reserve(2023, "b"), number)
+        self.assertEqual(restarted.find("b"), number)
+        self.assertEqual(restarted.reserve(2023, None), "2023044")
+
+    def test_reserve_many_in_order(self):
+        numbers = self.allocator.reserve_many([(2023, "a"), (2023, "b"), (2023, "a"), (2023, None)])
+        self.assertEqual(numbers, ["2023042", "2023043", "2023042", "2023044"])
+
+    def test_continues_legacy_count_file(self):
+        (self.dir / ".last_invoice_count").write_text("007")
+        self.assertEqual(self.allocator.reserve(2023, "a"), "2023008")
+
+    def test_concurrent_allocators_never_share_numbers(self):
+        numbers = []
+
+        def reserve(worker: int):
+            allocator = self._allocator()
+            for i in range(20):
+                numbers.append(allocator.reserve(2023, f"{worker}-{i}"))
+
+        threads = [threading.Thread(target=reserve, args=(w,)) for w in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(numbers)), 80)
+        self.assertEqual(max(numbers), "2023121")
+
+
+if __name__ == "__main__":
+    unittest.main()
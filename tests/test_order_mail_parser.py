@@ -2,7 +2,7 @@ from invoicer.config import load_config
 import unittest
 
 from invoicer.order import Address, Customer
-from invoicer.order_mail_parsers import OrderMailParser
+from invoicer.order_mail_parsers import OrderMailParser, find_country_index
 
 
 MAIL_BODY = 'Hallo!\r\n\r\nDu hast eine Bestellung (1357) über deinen Online-Shop\r\nwww.mustershop.de erhalten:\r\n\r\n\r\n==========\r\n\r\n2 x "Salvia uliginosa - Pfeffersalbei, Hummelschaukel" (Einzelpreis 7,50\r\n€): 15,00 €\r\n1 x "Tricyrtis macranthopsis" : 14,50 €\r\n2 x "Salvia greggii \'Blue Note\' - Pfirsich-Salbei" (Einzelpreis 7,00 €):\r\n14,00 €\r\n1 x "Corydalis calycosa" : 12,50 €\r\n1 x "Dicentra x hybr. \'Love Hearts\' - Tränendes Herz" : 10,00 €\r\n1 x "Corydalis nobilis - Edler Lerchensporn, Sibirischer Lerchensporn" :\r\n10,00 €\r\n1 x "Acanthus x hybr. \'Tasmanian Angel\'" : 10,00 €\r\n1 x "Dicentra cucullaria \'Pittsburg\'" : 9,50 €\r\n1 x "Acanthus x hybr. \'Whitewater\'" : 9,50 €\r\n1 x "Salvia argentea - Silber-Salbei" : 8,50 €\r\n1 x "Corydalis flexuosa \'Rainier Blue\' DJHC 0615" : 8,50 €\r\n1 x "Tricyrtis setouchiensis BSWJ4701" : 8,00 €\r\n1 x "Salvia forskaohlei - Bulgarischer Salbei, Balkan-Salbei" : 7,50 €\r\n1 x "Brunnera macrophylla \'Langtrees\'" : 7,50 €\r\n1 x "Corydalis flexuosa \'Blue Panda\' (Klon 2 - Typ Luckhardt)" : 7,50 €\r\n1 x "Tricyrtis formosana \'Small Wonder\' BSWJ306" : 7,50 €\r\n1 x "Corydalis linstowiana" : 7,50 €\r\n1 x "Penstemon mensarum - Tiger-Bartfaden" : 7,50 €\r\n1 x "Tricyrtis latifolia BSWJ10996" : 7,00 €\r\n1 x "Tricyrtis ravenii RWJ10012" : 7,00 €\r\n1 x "Primula japonica \'Carminea\' - Japanische Etagen-Schlüsselblume" : 7,00\r\n€\r\n1 x "Tricyrtis affinis BSWJ11063" : 7,00 €\r\n1 x "Polemonium reptans \'Blue Pearl\'" : 6,50 €\r\n1 x "Catananche caerulea \'Major\' - Blaue Rasselblume" : 6,50 €\r\n1 x "Lamium orvala \'Silva\' - Nesselkönig, Riesen-Taubnessel" : 6,50 €\r\n1 x "Corydalis flexuosa x omeiana \'Craigton Blue\'" : 6,50 €\r\n1 x "Tricyrtis formosana \'Dark Beauty\'" : 6,50 €\r\n1 x "Nepeta nervosa \'Neptune\' - Geaderte Katzenminze" : 5,50 €\r\n1 x "Tricyrtis hirta \'Taiwan Adbane\'" : 5,50 €\r\n1 x "Polemonium yezoense \'Purple Rain\' - Purpur-Jakobsleiter" : 5,50 €\r\n1 x "Tricyrtis hirta \'Sinonome\'" : 5,50 €\r\nSumme für alle Artikel: 257,50 €\r\n\r\n==========\r\n\r\n\r\nVersandkosten (inkl. MwSt.): 29,50 €\r\n----------------------------------------\r\n----------------------------------------\r\nGesamtpreis (inkl. MwSt.): 287,00 €\r\n\r\n\r\nBezahlmethode: Gegen Vorkasse\r\n\r\n*Rechnungs- und Versandadresse*\r\nMax Mustermann\r\nMusterweg 1\r\n01234 Berlin\r\nMusterland\r\nDeutschland\r\n004917612345678\r\ninfo@max.mustermann.com\r\n--\r\nDiese Bestelldaten findest du auch in der Bestellübersicht auf deiner\r\nWebseite: https://www.gaertnerei-bluetenreich.de/ Einfach einloggen und\r\nüber das Menü (auf der linken Seite) den Punkt "Shop" aufrufen.\r\n\r\n\r\n\r\n\r\n*Für Shops mit Sitz in einem EU-Land: Aufgrund neuer EU-Regelungen zur\r\nMehrwertsteuer gibt es Änderungen an deinem Onlineshop. Bitte stelle\r\nsicher, dass du bei all deinen Preisen bereits die MwSt. einkalkuliert\r\nhast.Befindet sich der Sitz deines Shops nicht in einem EU-Land, ändert\r\nsich nichts daran, wie die Mehrwertsteuer in deinem Shop angezeigt wird.*\r\n'    
@@ -28,6 +28,57 @@ class TestOrderAccount(unittest.TestCase):
         result = self.parser.find_invoice_address()
         self.assertEqual(result, correct)
 
+    def test_find_items(self):
+        items = self.parser.find_items()
+        self.assertEqual(len(items), 31)
+        self.assertAlmostEqual(sum(item.price for item in items), 257.50)
+        # Items whose unit price or total wraps onto the next line.
+        self.assertEqual((items[0].count, items[0].price), (2, 15.0))
+        self.assertEqual((items[2].description, items[2].price), ("Salvia greggii 'Blue Note' - Pfirsich-Salbei", 14.0))
+        self.assertEqual((items[3].description, items[3].price), ("Corydalis calycosa", 12.5))
+        self.assertEqual((items[20].price, items[21].description), (7.0, "Tricyrtis affinis BSWJ11063"))
+
+    def test_find_items_with_large_counts_and_prices(self):
+        parser = OrderMailParser(
+            subject=MAIL_SUBJECT,
+            body=MAIL_BODY.replace('1 x "Corydalis calycosa" : 12,50 €', '12 x "Corydalis calycosa" : 1.150,00 €'),
+        )
+        item = parser.find_items()[3]
+        self.assertEqual((item.count, item.description, item.price), (12, "Corydalis calycosa", 1150.0))
+
+    def test_find_other_fields(self):
+        self.assertEqual(self.parser.find_order_number(), "1357")
+        self.assertEqual(self.parser.find_shipping_cost(), 29.5)
+        self.assertEqual(self.parser.find_payment_method(short=True), "Vorkasse")
+        self.assertEqual(self.parser.find_payment_method(short=False), "Gegen Vorkasse")
+        self.assertEqual(self.parser.find_customer(), Customer(name="Max", surname="Mustermann"))
+
+    def test_html_line_breaks(self):
+        parser = OrderMailParser(subject=MAIL_SUBJECT, body=MAIL_BODY.replace("\r\n", "<br/>"))
+        self.assertEqual(parser.find_items(), self.parser.find_items())
+        self.assertEqual(parser.find_invoice_address(), self.parser.find_invoice_address())
+
+    def test_missing_fields(self):
+        parser = OrderMailParser(subject="Neue Bestellung", body="Hallo!\r\n")
+        with self.assertLogs(level="ERROR"):
+            self.assertIsNone(parser.find_order_number())
+            self.assertIsNone(parser.find_shipping_cost())
+            self.assertIsNone(parser.find_payment_method())
+            self.assertIsNone(parser.find_invoice_address())
+            self.assertIsNone(parser.find_customer())
+        self.assertEqual(parser.find_items(), [])
+
+
+class TestFindCountryIndex(unittest.TestCase):
+    def test_german_names(self):
+        self.assertEqual(find_country_index(["Musterweg 1", "01234 Berlin", "Deutschland", "0049"]), 2)
+        self.assertEqual(find_country_index(["Musterweg 1", "1010 Wien", "Österreich"]), 2)
+        self.assertIsNone(find_country_index(["Musterweg 1", "Germany"]))
+
+    def test_multiple_locales(self):
+        self.assertEqual(find_country_index(["Musterweg 1", "Germany"], locales=("de", "en")), 1)
+        self.assertEqual(find_country_index(["Rue 1", "France"], locales=("de", "fr")), 1)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
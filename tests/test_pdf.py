@@ -0,0 +1,74 @@
+import stat
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from invoicer.pdf import PdfConversionError, PdfConverter
+
+
+# Stands in for LibreOffice: "converts" each input by prefixing it, and logs its arguments.
+FAKE_SOFFICE = """#!{python}
+import sys
+from pathlib import Path
+
+args = sys.argv[1:]
+with open({log!r}, "a") as log:
+    log.write(" ".join(args) + "\\n")
+out_dir = Path(args[args.index("--outdir") + 1])
+for arg in args[args.index("--outdir") + 2 :]:
+    path = Path(arg)
+    if path.read_bytes() != b"broken":
+        (out_dir / path.with_suffix(".pdf").name).write_bytes(b"%PDF-" + path.read_bytes())
+"""
+
+
+def fake_soffice(directory: Path) -> Path:
+    """Write a fake soffice executable to `directory`, logging its calls to `directory / "calls.log"`."""
+    path = directory / "soffice"
+    path.write_text(FAKE_SOFFICE.format(python=sys.executable, log=str(directory / "calls.log")))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return path
+
+
+class TestPdfConverter(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dir = Path(tmp_dir.name)
+        self.soffice = fake_soffice(self.dir)
+
+    def _calls(self):
+        return (self.dir / "calls.log").read_text().splitlines()
+
+    def test_batches_are_split_among_workers(self):
+        converter = PdfConverter(workers=2, soffice=str(self.soffice))
+        documents = [f"doc {i}".encode() for i in range(5)]
+
+        self.assertEqual(converter.convert_many(documents), [b"%PDF-" + document for document in documents])
+        self.assertEqual(len(self._calls()), 2)
+
+    def test_profiles_are_kept_between_conversions(self):
+        converter = PdfConverter(workers=1, soffice=str(self.soffice))
+        self.assertEqual(converter.convert(b"a"), b"%PDF-a")
+        self.assertEqual(converter.convert(b"b"), b"%PDF-b")
+
+        profiles = [[arg for arg in call.split() if arg.startswith("-env:UserInstallation=")] for call in self._calls()]
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(profiles[0], profiles[1])
+
+    def test_failed_documents_do_not_fail_others(self):
+        converter = PdfConverter(soffice=str(self.soffice))
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(converter.convert_many([b"fine", b"broken", b"ok"]), [b"%PDF-fine", None, b"%PDF-ok"])
+
+    def test_failed_conversion_raises(self):
+        converter = PdfConverter(soffice=str(self.soffice))
+        with self.assertLogs(level="ERROR"), self.assertRaises(PdfConversionError):
+            converter.convert(b"broken")
+        with self.assertRaises(PdfConversionError):
+            PdfConverter(soffice=str(self.dir / "missing")).convert(b"a")
+
+
+if __name__ == "__main__":
+    unittest.main()
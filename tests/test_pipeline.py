@@ -0,0 +1,154 @@
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from invoicer.config import PipelineCfg
+from invoicer.pipeline import Stage, process_orders, run_pipeline
+from invoicer.processed import ProcessedMails
+
+
+class TestRunPipeline(unittest.TestCase):
+    def test_stage_workers_run_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def wait(item):
+            barrier.wait()
+            return item
+
+        result = run_pipeline(items=range(3), stages=(Stage("wait", wait, 3),), queue_size=1)
+        self.assertEqual(result.done, 3)
+
+    def test_failed_items_skip_later_stages(self):
+        reached = []
+
+        def fail_odd(item):
+            if item % 2:
+                raise ValueError(item)
+            return item
+
+        with self.assertLogs(level="ERROR"):
+            result = run_pipeline(
+                items=range(6), stages=(Stage("check", fail_odd, 2), Stage("collect", reached.append, 1)), queue_size=2
+            )
+        self.assertEqual(sorted(reached), [0, 2, 4])
+        self.assertEqual(result, (3, 3))
+
+    def test_batches_take_waiting_items(self):
+        batches = []
+
+        def slow_batch(items):
+            batches.append(items)
+            time.sleep(0.2)
+            return [item * 2 for item in items]
+
+        reached = []
+        result = run_pipeline(
+            items=range(6), stages=(Stage("batch", slow_batch, 1, batch_size=4), Stage("collect", reached.append, 1)), queue_size=8
+        )
+        self.assertEqual(result, (6, 0))
+        self.assertEqual(sorted(reached), [0, 2, 4, 6, 8, 10])
+        self.assertEqual(sorted(item for batch in batches for item in batch), list(range(6)))
+        self.assertLessEqual(max(map(len, batches)), 4)
+        self.assertLessEqual(len(batches), 3)
+
+
+class FakeGenerator:
+    def __init__(self) -> None:
+        self.count = 0
+        self.pdf_converter = None
+
+    def reserve_invoice_number(self, order):
+        self.count += 1
+        order.invoice.number = str(self.count)
+
+    def generate(self, order):
+        return order.invoice, []
+
+
+class FakeAccount:
+    def __init__(self) -> None:
+        self.labelled = []
+
+        self.sent = []
+
+    def send_invoice_mail(self, order, errors, invoice):
+        if order.number == "fail":
+            return None
+        self.sent.append(order.number)
+        return "sent"
+
+    def label_invoiced(self, order):
+        self.labelled.append(order.number)
+
+
+class TestProcessOrders(unittest.TestCase):
+    def test_numbers_follow_mail_order_and_unsent_invoices_stay_unlabelled(self):
+        orders = [SimpleNamespace(number=str(i), invoice=SimpleNamespace(number=None)) for i in range(20)]
+        orders[5].number = "fail"
+        account = FakeAccount()
+        cfg = PipelineCfg(renderWorkers=4, sendWorkers=4, labelWorkers=2, queueSize=2)
+
+        with self.assertLogs(level="INFO"):
+            result = process_orders(orders=orders, invoicer_account=account, invoice_generator=FakeGenerator(), cfg=cfg)
+
+        self.assertEqual([o.invoice.number for o in orders], [str(i + 1) for i in range(20)])
+        self.assertEqual(result, (19, 1))
+        self.assertNotIn("fail", account.labelled)
+
+    def test_sent_invoices_are_not_sent_again(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        processed = ProcessedMails(Path(tmp_dir.name) / "processed.sqlite3")
+        orders = [
+            SimpleNamespace(number=str(i), invoice=SimpleNamespace(number=None), source_mail=SimpleNamespace(ident=f"m{i}"))
+            for i in range(4)
+        ]
+        orders[2].number = "fail"
+        account = FakeAccount()
+        cfg = PipelineCfg(renderWorkers=2, sendWorkers=2, labelWorkers=1, queueSize=2)
+
+        with self.assertLogs(level="INFO"):
+            process_orders(orders, invoicer_account=account, invoice_generator=FakeGenerator(), cfg=cfg, processed=processed)
+        self.assertEqual(processed.stages(["m0", "m2"]), {"m0": "sent", "m2": "rendered"})
+
+        account = FakeAccount()
+        for order in orders:
+            order.invoice.number = None
+        with self.assertLogs(level="WARNING"):
+            result = process_orders(orders, invoicer_account=account, invoice_generator=FakeGenerator(), cfg=cfg, processed=processed)
+        self.assertEqual(result, (0, 1))
+        self.assertEqual(account.sent, [])
+        self.assertEqual(sorted(account.labelled), ["0", "1", "3"])
+
+    def test_pdfs_are_added_before_sending(self):
+        orders = [SimpleNamespace(number=str(i), invoice=SimpleNamespace(number=None, pdf=None)) for i in range(4)]
+        generator = FakeGenerator()
+        generator.pdf_converter = SimpleNamespace(workers=2)
+
+        conversions = []
+
+        def add_pdfs(invoices):
+            conversions.append(len(invoices))
+            time.sleep(0.1)
+            for invoice in invoices:
+                invoice.pdf = b"%PDF"
+            return [True] * len(invoices)
+
+        generator.add_pdfs = add_pdfs
+        account = FakeAccount()
+        account.send_invoice_mail = lambda order, errors, invoice: invoice.pdf and "sent"
+        cfg = PipelineCfg(renderWorkers=2, sendWorkers=2, labelWorkers=1, queueSize=4)
+
+        with self.assertLogs(level="INFO"):
+            result = process_orders(orders=orders, invoicer_account=account, invoice_generator=generator, cfg=cfg)
+        self.assertEqual(result, (4, 0))
+        # Invoices rendered during a conversion are converted together.
+        self.assertEqual(sum(conversions), 4)
+        self.assertLess(len(conversions), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
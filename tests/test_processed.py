@@ -0,0 +1,32 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from invoicer.processed import ProcessedMails
+
+
+class TestProcessedMails(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = Path(tmp_dir.name) / "processed.sqlite3"
+        self.processed = ProcessedMails(self.path)
+
+    def test_stages_only_move_forward(self):
+        self.processed.advance("m0", "parsed")
+        self.processed.advance("m0", "numbered", invoice_number="2023001")
+        self.processed.advance("m0", "sent")
+        self.processed.advance("m0", "rendered")
+        self.processed.advance("m1", "parsed")
+
+        self.assertEqual(self.processed.stages(["m0", "m1", "m2"]), {"m0": "sent", "m1": "parsed"})
+        self.assertEqual(self.processed.invoice_number("m0"), "2023001")
+
+    def test_survives_restart(self):
+        self.processed.advance_many(["m0", "m1"], "labelled")
+
+        self.assertEqual(ProcessedMails(self.path).stages(["m0", "m1"]), {"m0": "labelled", "m1": "labelled"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import sys
+import unittest
+
+from invoicer.mail import Mail
+from invoicer.order_mail_parsers import order_from_mail
+from invoicer.providers import PROVIDERS, ProviderRegistry, ShopProvider
+from tests.test_order_mail_parser import MAIL_BODY, MAIL_SUBJECT
+
+
+def _mail(sender="shop@example.com", subject=MAIL_SUBJECT, body=MAIL_BODY):
+    return Mail(sender=sender, to="me@example.com", subject=subject, plain_text=body, ident="1")
+
+
+def _parse_other_shop(mail):
+    return "other shop order"
+
+
+class TestProviderRegistry(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = ProviderRegistry()
+        self.registry.register(
+            ShopProvider(
+                name="other_shop",
+                parser="tests.test_providers:_parse_other_shop",
+                senders=("Orders@Other-Shop.com",),
+                subject_prefixes=("Neue Bestellung", "New order"),
+                marker=None,
+            )
+        )
+        self.registry.register(
+            ShopProvider(
+                name="online_shop",
+                parser="invoicer.order_mail_parsers:parse_online_shop_mail",
+                senders=(),
+                subject_prefixes=("Neue Bestellung",),
+                marker="über deinen Online-Shop",
+            )
+        )
+
+    def test_find_by_sender_subject_and_marker(self):
+        self.assertEqual(self.registry.find(_mail(sender="orders@other-shop.com")).name, "other_shop")
+        self.assertEqual(self.registry.find(_mail(sender="orders@other-shop.com", subject="New order 12")).name, "other_shop")
+        # Forwarded mails match by their original subject.
+        self.assertEqual(self.registry.find(_mail()).name, "online_shop")
+        self.assertIsNone(self.registry.find(_mail(body="Hallo!")))
+        self.assertIsNone(self.registry.find(_mail(subject="Frage zur Bestellung")))
+
+    def test_parsers_are_loaded_on_first_use(self):
+        sys.modules.pop("tests.test_providers_plugin", None)
+        self.registry.register(
+            ShopProvider(
+                name="plugin_shop",
+                parser="tests.test_providers_plugin:parse",
+                senders=("plugin@example.com",),
+                subject_prefixes=(),
+                marker=None,
+            )
+        )
+        self.assertNotIn("tests.test_providers_plugin", sys.modules)
+        with self.assertRaises(ModuleNotFoundError):
+            self.registry.parse(_mail(sender="plugin@example.com"))
+        self.assertEqual(self.registry.parse(_mail(sender="orders@other-shop.com")), "other shop order")
+
+    def test_duplicate_provider(self):
+        with self.assertRaises(ValueError):
+            self.registry.register(ShopProvider("other_shop", "tests.test_providers:_parse_other_shop", (), (), None))
+
+    def test_no_match(self):
+        with self.assertRaises(LookupError):
+            self.registry.parse(_mail(body="Hallo!"))
+
+
+class TestOrderFromMail(unittest.TestCase):
+    def test_default_provider(self):
+        order = order_from_mail(_mail())
+        self.assertEqual(order.number, "1357")
+        self.assertEqual(len(order.items), 31)
+        # Mails no provider matches fall back to the built-in shop template.
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(PROVIDERS.find(_mail(subject="Bestellung 1357")).name, "online_shop")
+
+
+if __name__ == "__main__":
+    unittest.main()
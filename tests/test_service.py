@@ -0,0 +1,62 @@
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+
+from invoicer.service import Invoicer
+
+
+class TestInvoicer(unittest.TestCase):
+    def setUp(self) -> None:
+        cfg = SimpleNamespace(pollInterval=0.01, customerMailPollInterval=None, maxRetryInterval=0.04)
+        self.invoicer = Invoicer(cfg=cfg, account=None, generator=None)
+        self.calls = {"orders": [], "customer_mails": []}
+
+    def _run_for(self, seconds: float):
+        async def run():
+            task = asyncio.create_task(self.invoicer.run())
+            await asyncio.sleep(seconds)
+            self.invoicer.stop()
+            await asyncio.wait_for(task, timeout=1)
+
+        with self.assertLogs(level="INFO"):
+            asyncio.run(run())
+
+    def test_failing_flow_does_not_block_the_other(self):
+        def fail():
+            self.calls["orders"].append(time.monotonic())
+            raise RuntimeError("Gmail is down")
+
+        self.invoicer.process_new_orders = fail
+        self.invoicer.forward_new_customer_mails = lambda: self.calls["customer_mails"].append(time.monotonic())
+        self._run_for(0.3)
+
+        self.assertGreater(len(self.calls["customer_mails"]), 2 * len(self.calls["orders"]))
+
+    def test_failures_back_off(self):
+        def fail():
+            self.calls["orders"].append(time.monotonic())
+            raise RuntimeError("Gmail is down")
+
+        self.invoicer.process_new_orders = fail
+        self.invoicer.forward_new_customer_mails = lambda: None
+        self._run_for(0.2)
+
+        waits = [b - a for a, b in zip(self.calls["orders"], self.calls["orders"][1:])]
+        self.assertGreaterEqual(waits[0], 0.02)
+        self.assertGreaterEqual(min(waits[1:]), 0.04)
+
+    def test_stop_finishes_running_cycle(self):
+        def slow():
+            time.sleep(0.1)
+            self.calls["orders"].append("done")
+
+        self.invoicer.process_new_orders = slow
+        self.invoicer.forward_new_customer_mails = lambda: None
+        self._run_for(0.05)
+
+        self.assertEqual(self.calls["orders"], ["done"])
+
+
+if __name__ == "__main__":
+    unittest.main()
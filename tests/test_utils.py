@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from invoicer.utils import atomic_write
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = Path(tmp_dir.name) / "cache.json"
+
+    def test_replaces_file_once_written(self):
+        self.path.write_text("old")
+        with atomic_write(self.path) as f:
+            f.write("new")
+            self.assertEqual(self.path.read_text(), "old")
+        self.assertEqual(self.path.read_text(), "new")
+        self.assertEqual(os.listdir(self.path.parent), ["cache.json"])
+
+    def test_failed_write_keeps_file(self):
+        self.path.write_bytes(b"old")
+        with self.assertRaises(ValueError):
+            with atomic_write(self.path, mode="wb") as f:
+                f.write(b"new")
+                raise ValueError()
+        self.assertEqual(self.path.read_bytes(), b"old")
+        self.assertEqual(os.listdir(self.path.parent), ["cache.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()